@@ -0,0 +1,110 @@
+"""Chunk statistics table
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-02-01
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Per-document chunk statistics maintained by triggers, so the vector
+    # store stats endpoint does not have to scan every chunk
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_stats (
+            document_id UUID PRIMARY KEY,
+            chunk_count BIGINT NOT NULL DEFAULT 0,
+            total_length BIGINT NOT NULL DEFAULT 0,
+            last_indexed TIMESTAMP WITH TIME ZONE
+        )
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chunk_stats_after_insert()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO chunk_stats (document_id, chunk_count, total_length, last_indexed)
+            SELECT document_id, COUNT(*), SUM(length(content)), MAX(created_at)
+            FROM new_chunks
+            GROUP BY document_id
+            ON CONFLICT (document_id) DO UPDATE SET
+                chunk_count = chunk_stats.chunk_count + EXCLUDED.chunk_count,
+                total_length = chunk_stats.total_length + EXCLUDED.total_length,
+                last_indexed = GREATEST(chunk_stats.last_indexed, EXCLUDED.last_indexed);
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql'
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chunk_stats_after_delete()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            UPDATE chunk_stats s SET
+                chunk_count = s.chunk_count - d.chunk_count,
+                total_length = s.total_length - d.total_length
+            FROM (
+                SELECT document_id, COUNT(*) AS chunk_count, SUM(length(content)) AS total_length
+                FROM old_chunks
+                GROUP BY document_id
+            ) d
+            WHERE s.document_id = d.document_id;
+
+            DELETE FROM chunk_stats WHERE chunk_count <= 0;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql'
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chunk_stats_after_truncate()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            DELETE FROM chunk_stats;
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql'
+    """)
+
+    # Statement-level triggers see a whole COPY/DELETE batch at once
+    op.execute("""
+        CREATE TRIGGER chunk_stats_insert AFTER INSERT ON chunks
+            REFERENCING NEW TABLE AS new_chunks
+            FOR EACH STATEMENT EXECUTE FUNCTION chunk_stats_after_insert()
+    """)
+    op.execute("""
+        CREATE TRIGGER chunk_stats_delete AFTER DELETE ON chunks
+            REFERENCING OLD TABLE AS old_chunks
+            FOR EACH STATEMENT EXECUTE FUNCTION chunk_stats_after_delete()
+    """)
+    op.execute("""
+        CREATE TRIGGER chunk_stats_truncate AFTER TRUNCATE ON chunks
+            FOR EACH STATEMENT EXECUTE FUNCTION chunk_stats_after_truncate()
+    """)
+
+    # Backfill from existing chunks
+    op.execute("""
+        INSERT INTO chunk_stats (document_id, chunk_count, total_length, last_indexed)
+        SELECT document_id, COUNT(*), SUM(length(content)), MAX(created_at)
+        FROM chunks
+        GROUP BY document_id
+        ON CONFLICT (document_id) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS chunk_stats_truncate ON chunks')
+    op.execute('DROP TRIGGER IF EXISTS chunk_stats_delete ON chunks')
+    op.execute('DROP TRIGGER IF EXISTS chunk_stats_insert ON chunks')
+    op.execute('DROP FUNCTION IF EXISTS chunk_stats_after_truncate()')
+    op.execute('DROP FUNCTION IF EXISTS chunk_stats_after_delete()')
+    op.execute('DROP FUNCTION IF EXISTS chunk_stats_after_insert()')
+    op.drop_table('chunk_stats')
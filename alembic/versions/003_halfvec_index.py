@@ -0,0 +1,73 @@
+"""Half-precision embedding index
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-02-08
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def _pgvector_version() -> tuple:
+    version = op.get_bind().execute(
+        sa.text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    ).scalar()
+    return tuple(int(part) for part in version.split('.')[:2])
+
+
+def upgrade() -> None:
+    # halfvec needs pgvector >= 0.7. Upgrading the extension is left to the
+    # operator; until then searches keep using the existing index, and the
+    # vector store falls back to full precision when it finds no halfvec index.
+    if _pgvector_version() < (0, 7):
+        logging.getLogger('alembic.runtime.migration').warning(
+            "pgvector < 0.7, skipping idx_chunks_embedding_halfvec; after upgrading the "
+            "extension, create it as in this migration"
+        )
+        return
+
+    # CONCURRENTLY can't run inside a transaction, but doesn't block writes to
+    # chunks while the HNSW graph is built
+    with op.get_context().autocommit_block():
+        # A failed concurrent build leaves an invalid index behind; IF NOT EXISTS
+        # would keep it, so drop it first
+        op.execute("""
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE c.relname = 'idx_chunks_embedding_halfvec' AND NOT i.indisvalid
+                ) THEN
+                    DROP INDEX idx_chunks_embedding_halfvec;
+                END IF;
+            END
+            $$
+        """)
+
+        # Index half-precision copies of the embeddings; the column itself keeps
+        # full precision for scoring
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chunks_embedding_halfvec ON chunks '
+            'USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops) '
+            'WITH (m = 16, ef_construction = 64)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS chunks_embedding_idx')
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS idx_chunks_embedding')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS chunks_embedding_idx ON chunks '
+            'USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100)'
+        )
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS idx_chunks_embedding_halfvec')
@@ -0,0 +1,49 @@
+"""Chunk change notifications
+
+Revision ID: 004
+Revises: 003
+Create Date: 2024-02-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Every write to chunks sends a chunks_changed notification. Each worker
+    # process LISTENs for it and drops its cached search results and in-memory
+    # index, so a write made through one worker invalidates the caches of all
+    # others. NOTIFY takes no row lock, so concurrent writers don't serialize
+    # on it, and it is only delivered once the writing transaction commits.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chunks_changed_notify()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            PERFORM pg_notify('chunks_changed', '');
+            RETURN NULL;
+        END;
+        $$ language 'plpgsql'
+    """)
+
+    # Statement-level, and identical notifications within a transaction are
+    # folded into one, so a whole COPY/DELETE batch notifies once
+    op.execute("""
+        CREATE TRIGGER chunks_changed_write AFTER INSERT OR UPDATE OR DELETE ON chunks
+            FOR EACH STATEMENT EXECUTE FUNCTION chunks_changed_notify()
+    """)
+    op.execute("""
+        CREATE TRIGGER chunks_changed_truncate AFTER TRUNCATE ON chunks
+            FOR EACH STATEMENT EXECUTE FUNCTION chunks_changed_notify()
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER IF EXISTS chunks_changed_truncate ON chunks')
+    op.execute('DROP TRIGGER IF EXISTS chunks_changed_write ON chunks')
+    op.execute('DROP FUNCTION IF EXISTS chunks_changed_notify()')
@@ -2,7 +2,7 @@
 Chat and Q&A API endpoints.
 """
 import logging
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
@@ -32,6 +32,22 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/chat", tags=["chat"])
 
 
+async def _document_names(
+    db: asyncpg.Connection,
+    search_results: List[Tuple[UUID, str, float, Dict[str, Any]]]
+) -> Dict[str, str]:
+    """Look up the original names of all documents in the search results in one query."""
+    doc_ids = {metadata['document_id'] for _, _, _, metadata in search_results if metadata.get('document_id')}
+    if not doc_ids:
+        return {}
+    
+    rows = await db.fetch(
+        "SELECT id::text AS id, original_name FROM documents WHERE id = ANY($1::uuid[])",
+        list(doc_ids)
+    )
+    return {row['id']: row['original_name'] for row in rows}
+
+
 @router.post("/", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -49,7 +65,7 @@ async def chat(
         # If user is authenticated, filter to their documents
         filter_document_ids = None
         if request.document_ids:
-            filter_document_ids = [UUID(id) for id in request.document_ids]
+            filter_document_ids = list(request.document_ids)
         elif current_user:
             # Get user's document IDs
             user_docs = await db.fetch(
@@ -68,24 +84,11 @@ async def chat(
         )
         
         # Prepare context chunks
-        context_chunks = []
-        sources = []
-        
-        for chunk_id, content, similarity, metadata in search_results:
-            context_chunks.append({
-                "content": content,
-                "metadata": metadata
-            })
-            
-            # Get document info for source
-            doc_id = metadata.get('document_id')
-            if doc_id:
-                doc = await db.fetchrow(
-                    "SELECT original_name FROM documents WHERE id = $1",
-                    UUID(doc_id)
-                )
-                if doc and doc['original_name'] not in sources:
-                    sources.append(doc['original_name'])
+        context_chunks = [
+            {"chunk_id": str(chunk_id), "content": content, "metadata": metadata}
+            for chunk_id, content, _, metadata in search_results
+        ]
+        document_names = await _document_names(db, search_results)
         
         # Generate response
         logger.info(f"Calling LLM service with stream=False")
@@ -102,19 +105,14 @@ async def chat(
         seen_docs = set()
         for _, _, similarity, metadata in search_results:
             doc_id = metadata.get('document_id')
-            if doc_id and doc_id not in seen_docs:
-                doc = await db.fetchrow(
-                    "SELECT original_name FROM documents WHERE id = $1",
-                    UUID(doc_id)
-                )
-                if doc:
-                    document_sources.append(DocumentSource(
-                        document_id=doc_id,
-                        document_name=doc['original_name'],
-                        chunk_id="",  # Not used for now
-                        similarity_score=similarity
-                    ))
-                    seen_docs.add(doc_id)
+            if doc_id and doc_id not in seen_docs and doc_id in document_names:
+                document_sources.append(DocumentSource(
+                    document_id=doc_id,
+                    document_name=document_names[doc_id],
+                    chunk_id="",  # Not used for now
+                    similarity_score=similarity
+                ))
+                seen_docs.add(doc_id)
         
         return ChatResponse(
             answer=response_text,
@@ -133,6 +131,7 @@ async def chat(
 @router.post("/search", response_model=SearchResponse)
 async def search_documents(
     request: SearchRequest,
+    current_user: Optional[dict] = Depends(get_current_user_optional),
     embeddings_service: EmbeddingsService = Depends(get_embeddings_service),
     vector_store: VectorStore = Depends(get_vector_store),
     db: asyncpg.Connection = Depends(get_db)
@@ -145,7 +144,7 @@ async def search_documents(
         # If user is authenticated, filter to their documents
         filter_document_ids = None
         if request.document_ids:
-            filter_document_ids = [UUID(id) for id in request.document_ids]
+            filter_document_ids = list(request.document_ids)
         elif current_user:
             # Get user's document IDs
             user_docs = await db.fetch(
@@ -160,36 +159,26 @@ async def search_documents(
             query_embedding=query_embedding,
             k=request.max_results,
             filter_document_ids=filter_document_ids,
-            threshold=request.similarity_threshold
+            threshold=request.threshold
         )
         
         # Format results
+        document_names = await _document_names(db, search_results)
         results = []
         for chunk_id, content, similarity, metadata in search_results:
-            # Get document info
             doc_id = metadata.get('document_id')
-            doc_name = "Unknown"
-            
-            if doc_id:
-                doc = await db.fetchrow(
-                    "SELECT original_name FROM documents WHERE id = $1",
-                    UUID(doc_id)
-                )
-                if doc:
-                    doc_name = doc['original_name']
-            
             results.append(SearchResult(
                 chunk_id=str(chunk_id),
                 document_id=doc_id,
-                document_name=doc_name,
-                content=content,
+                document_name=document_names.get(doc_id, "Unknown"),
+                chunk_content=content,
                 similarity_score=similarity,
                 metadata=metadata
             ))
         
         return SearchResponse(
             results=results,
-            total=len(results),
+            total_results=len(results),
             query=request.query
         )
         
@@ -216,19 +205,19 @@ async def chat_stream(
         search_results = await vector_store.similarity_search(
             query_embedding=query_embedding,
             k=request.max_results,
-            filter_document_ids=[UUID(id) for id in request.document_ids] if request.document_ids else None,
+            filter_document_ids=request.document_ids or None,
             threshold=request.similarity_threshold
         )
         
         # Prepare context
         context_chunks = [
-            {"content": content, "metadata": metadata}
-            for _, content, _, metadata in search_results
+            {"chunk_id": str(chunk_id), "content": content, "metadata": metadata}
+            for chunk_id, content, _, metadata in search_results
         ]
         
         # Generate streaming response
         async def generate():
-            async for chunk in llm_service.generate_response(
+            async for chunk in await llm_service.generate_response(
                 query=request.query,
                 context_chunks=context_chunks,
                 chat_history=request.chat_history,
@@ -291,12 +280,12 @@ async def chat_websocket(
                 
                 # Prepare context
                 context_chunks = [
-                    {"content": content, "metadata": metadata}
-                    for _, content, _, metadata in search_results
+                    {"chunk_id": str(chunk_id), "content": content, "metadata": metadata}
+                    for chunk_id, content, _, metadata in search_results
                 ]
                 
                 # Stream response
-                async for chunk in llm_service.generate_response(
+                async for chunk in await llm_service.generate_response(
                     query=query,
                     context_chunks=context_chunks,
                     chat_history=chat_history,
@@ -7,13 +7,13 @@ from typing import List, Optional
 from uuid import UUID, uuid4
 from datetime import datetime
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 import asyncpg
 
 from ...schemas.document import (
     DocumentResponse,
     DocumentListResponse,
-    DocumentProcessingStatus
+    DocumentStatus
 )
 from ...models.document import Document
 from ...core.config import settings
@@ -142,7 +142,7 @@ async def upload_document(
 async def list_documents(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
-    status: Optional[DocumentProcessingStatus] = None,
+    status: Optional[DocumentStatus] = None,
     current_user: dict = Depends(get_current_active_user),
     db: asyncpg.Connection = Depends(get_db)
 ):
@@ -153,7 +153,7 @@ async def list_documents(
     
     if status:
         query += " AND status = $2"
-        params.append(status)
+        params.append(status.value)
     
     query += " ORDER BY created_at DESC"
     
@@ -291,12 +291,12 @@ async def download_document(
         # Download from S3
         content = await document_processor.download_from_s3(row['s3_key'])
         
-        # Return as streaming response
-        return StreamingResponse(
+        # download_from_s3 returns the whole object, so send it as one body
+        return Response(
             content=content,
             media_type=row['content_type'],
             headers={
-                "Content-Disposition": f"attachment; filename={row['original_name']}"
+                "Content-Disposition": f'attachment; filename="{row["original_name"]}"'
             }
         )
         
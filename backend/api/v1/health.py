@@ -4,10 +4,9 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.core.database import get_db
-from backend.services.vector_store import VectorStore
-from backend.services.embeddings import EmbeddingsService
 from backend.services.llm import LLMService
 from backend.core.config import get_settings
+from backend.core.dependencies import get_embeddings_service, get_llm_service, get_vector_store
 
 router = APIRouter()
 settings = get_settings()
@@ -24,8 +23,12 @@ async def health_check():
 
 
 @router.get("/health/detailed", response_model=Dict[str, Any])
-async def detailed_health_check(db: AsyncSession = Depends(get_db)):
-    """Detailed health check including all dependencies"""
+async def detailed_health_check(
+    deep: bool = False,
+    db: AsyncSession = Depends(get_db),
+    llm_service: LLMService = Depends(get_llm_service)
+):
+    """Detailed health check including all dependencies; `deep=true` runs a real LLM completion"""
     health_status = {
         "status": "healthy",
         "checks": {
@@ -47,8 +50,8 @@ async def detailed_health_check(db: AsyncSession = Depends(get_db)):
     
     # Check vector store
     try:
-        vector_store = VectorStore()
-        await vector_store.verify_connection(db)
+        vector_store = await get_vector_store()
+        await vector_store.verify_connection()
         health_status["checks"]["vector_store"] = True
     except Exception as e:
         health_status["status"] = "degraded"
@@ -56,9 +59,11 @@ async def detailed_health_check(db: AsyncSession = Depends(get_db)):
     
     # Check embeddings service
     try:
-        embeddings_service = EmbeddingsService()
-        test_embedding = await embeddings_service.embed_text("test")
-        if test_embedding and len(test_embedding) == 1536:
+        # The shared instance, so each check doesn't build a client and worker pool
+        embeddings_service = await get_embeddings_service()
+        # Bypasses the query cache, so the model is actually called
+        test_embeddings = await embeddings_service.generate_embeddings(["test"])
+        if test_embeddings.shape == (1, 1536):
             health_status["checks"]["embeddings_service"] = True
     except Exception as e:
         health_status["status"] = "degraded"
@@ -66,10 +71,11 @@ async def detailed_health_check(db: AsyncSession = Depends(get_db)):
     
     # Check LLM service
     try:
-        llm_service = LLMService()
-        test_response = await llm_service.generate_response("test", "test")
-        if test_response:
+        llm_health = await llm_service.health_check(deep=deep)
+        if llm_health["test_successful"]:
             health_status["checks"]["llm_service"] = True
+        else:
+            health_status["details"]["llm_error"] = llm_health.get("error")
     except Exception as e:
         health_status["status"] = "degraded"
         health_status["details"]["llm_error"] = str(e)
@@ -11,6 +11,12 @@ from backend.core.config import settings
 from backend.core.logger import get_logger
 from backend.api.v1 import api_router
 from backend.core.database import get_db_pool
+from backend.core.dependencies import (
+    close_document_processor,
+    close_embeddings_service,
+    close_llm_service,
+    close_vector_store
+)
 
 logger = get_logger(__name__)
 
@@ -28,6 +34,10 @@ async def lifespan(app: FastAPI):
     
     # Cleanup
     logger.info("Shutting down Brain application")
+    await close_document_processor()
+    await close_vector_store()
+    close_llm_service()
+    close_embeddings_service()
 
 
 # Create FastAPI app
@@ -4,12 +4,30 @@ Separate configuration for Bedrock services to avoid credential conflicts with M
 import os
 import logging
 from typing import Optional
+from botocore.config import Config
+
+from .boto_config import boto_client_config
 
 logger = logging.getLogger(__name__)
 
 class BedrockConfig:
     """Configuration specifically for AWS Bedrock services"""
     
+    @staticmethod
+    def get_client_config() -> Config:
+        """Get botocore client tuning shared by the Bedrock runtime clients"""
+        return boto_client_config()
+    
+    @staticmethod
+    def get_llm_client_config() -> Config:
+        """Get botocore client tuning for LLM calls, which LLMService retries itself"""
+        return boto_client_config(
+            max_pool_connections=64,
+            retries={'max_attempts': 0, 'mode': 'standard'},
+            connect_timeout=5,
+            read_timeout=120  # long generations stream for a while
+        )
+    
     @staticmethod
     def get_aws_credentials():
         """Get AWS credentials for Bedrock, handling MinIO conflict"""
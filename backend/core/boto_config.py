@@ -0,0 +1,22 @@
+"""
+Shared botocore client tuning for the AWS clients (S3 and Bedrock).
+"""
+from typing import Any
+from botocore.config import Config
+
+
+def boto_client_config(**overrides: Any) -> Config:
+    """
+    Get the botocore Config used by every AWS client.
+    
+    A connection pool large enough that concurrent requests don't discard
+    connections, adaptive retries and TCP keepalive. Keyword arguments
+    override individual settings.
+    """
+    options = {
+        'max_pool_connections': 50,
+        'retries': {'max_attempts': 10, 'mode': 'adaptive'},
+        'tcp_keepalive': True,
+    }
+    options.update(overrides)
+    return Config(**options)
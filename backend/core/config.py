@@ -30,6 +30,26 @@ class Settings(BaseSettings):
     # Bedrock
     bedrock_model_id: str = "anthropic.claude-instant-v1"
     bedrock_embedding_model: str = "amazon.titan-embed-text-v1"
+    bedrock_prompt_cache: bool = True  # send cachePoint blocks to models that support prompt caching
+    embedding_pool_size: int = 16  # worker threads for concurrent Titan embedding calls
+    embedding_max_retries: int = 4  # retries for throttled/unavailable Titan calls
+    embedding_cache_size: int = 1024  # cached query embeddings; 0 disables caching
+    embedding_cache_ttl: int = 86400  # seconds
+    
+    # LLM
+    llm_pool_size: int = 32  # worker threads for concurrent Bedrock calls
+    llm_max_retries: int = 4  # retries for throttled/unavailable Bedrock calls
+    
+    # LLM response cache
+    llm_cache_size: int = 1024  # max cached responses; 0 disables caching
+    llm_cache_ttl: int = 3600  # seconds
+    llm_negative_cache_ttl: int = 3600  # seconds to remember "not found in the documents" answers
+    
+    # Redaction API
+    redaction_api_url: str = "https://101pi5aiv5.execute-api.us-east-1.amazonaws.com/production/api/string/redact"
+    redaction_api_key: Optional[str] = None
+    redaction_required: bool = True  # refuse to store documents that could not be redacted
+    redaction_gzip: bool = False  # gzip request bodies sent to the redaction API; retried uncompressed on a 4xx
     
     # Redis (optional)
     redis_url: Optional[str] = "redis://localhost:6379"
@@ -49,6 +69,14 @@ class Settings(BaseSettings):
     embedding_dimension: int = 1536  # Titan embeddings
     max_search_results: int = 10
     similarity_threshold: float = 0.7
+    vector_cache_size: int = 1024  # cached similarity search results; 0 disables caching
+    vector_cache_ttl: int = 300  # seconds
+    vector_semantic_cache_threshold: float = 0.98  # cosine similarity to reuse a near-identical query; >1 disables
+    vector_stats_table: bool = True  # read get_stats from the trigger-maintained chunk_stats table
+    vector_halfvec_index: bool = True  # search through the half-precision HNSW index when migration 003 built it
+    vector_in_memory_index: bool = False  # serve searches from an in-process copy of all embeddings
+    vector_in_memory_max_chunks: int = 100_000  # larger corpora stay on pgvector (~6KB of memory per chunk)
+    vector_in_memory_reload_delay: float = 1.0  # seconds without chunk writes before the index is reloaded
     
     class Config:
         env_file = ".env"
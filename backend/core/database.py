@@ -2,8 +2,10 @@
 Database connection and session management.
 """
 
-from typing import AsyncGenerator, Optional
+from typing import Any, AsyncGenerator, Optional
 import asyncpg
+import orjson
+from pgvector.asyncpg import register_vector as pgvector_register_vector
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 
@@ -50,43 +52,55 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
 
 async def get_raw_connection() -> asyncpg.Connection:
     """Get raw asyncpg connection for vector operations."""
-    # Parse connection parameters from URL
-    db_url = settings.database_url
-    if db_url.startswith("postgresql://"):
-        db_url = db_url[13:]  # Remove postgresql://
-    
-    user_pass, host_db = db_url.split("@")
-    user, password = user_pass.split(":")
-    host_port, db_name = host_db.split("/")
+    # asyncpg parses the DSN itself, including URL-encoded credentials
+    return await asyncpg.connect(settings.database_url)
+
+
+async def register_vector(conn: asyncpg.Connection) -> None:
+    """
+    Register pgvector's binary codec with an asyncpg connection.
     
-    if ":" in host_port:
-        host, port = host_port.split(":")
-        port = int(port)
-    else:
-        host = host_port
-        port = 5432
+    The vector extension itself is created by the schema (scripts/init_db.sql
+    or the alembic migrations), so this costs no extra statement per connection.
+    """
+    # Binary codec: required for COPY into vector columns, and decodes to numpy
+    await pgvector_register_vector(conn)
+
+
+def encode_jsonb(value: Any) -> bytes:
+    """
+    Serialize a value to the binary jsonb wire format.
     
-    return await asyncpg.connect(
-        host=host,
-        port=port,
-        user=user,
-        password=password,
-        database=db_name
-    )
+    The result can be passed as a jsonb parameter as-is, so a value shared
+    by many rows only has to be serialized once.
+    """
+    if isinstance(value, bytes):
+        return value
+    # Binary jsonb is a version byte followed by the JSON text
+    return b"\x01" + orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY)
 
 
-async def register_vector(conn: asyncpg.Connection) -> None:
-    """Register pgvector type with asyncpg connection."""
-    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
-    # Register the vector type
+def _decode_jsonb(data: bytes) -> Any:
+    return orjson.loads(data[1:])
+
+
+async def register_jsonb(conn: asyncpg.Connection) -> None:
+    """Register an orjson-backed jsonb codec, so jsonb values are plain Python objects."""
     await conn.set_type_codec(
-        'vector',
-        encoder=lambda v: v,
-        decoder=lambda v: v,
-        format='text'
+        "jsonb",
+        encoder=encode_jsonb,
+        decoder=_decode_jsonb,
+        schema="pg_catalog",
+        format="binary"
     )
 
 
+async def init_connection(conn: asyncpg.Connection) -> None:
+    """Set up type codecs on a new pool connection."""
+    await register_vector(conn)
+    await register_jsonb(conn)
+
+
 # Global database pool
 _db_pool: Optional[asyncpg.Pool] = None
 
@@ -96,36 +110,14 @@ async def get_db_pool() -> asyncpg.Pool:
     global _db_pool
     
     if _db_pool is None:
-        # Parse connection parameters from URL
-        db_url = settings.database_url
-        if db_url.startswith("postgresql://"):
-            db_url = db_url[13:]  # Remove postgresql://
-        
-        user_pass, host_db = db_url.split("@")
-        user, password = user_pass.split(":")
-        host_port, db_name = host_db.split("/")
-        
-        if ":" in host_port:
-            host, port = host_port.split(":")
-            port = int(port)
-        else:
-            host = host_port
-            port = 5432
-        
         _db_pool = await asyncpg.create_pool(
-            host=host,
-            port=port,
-            user=user,
-            password=password,
-            database=db_name,
+            settings.database_url,
             min_size=5,
             max_size=20,
-            command_timeout=60
+            command_timeout=60,
+            # Runs for every connection the pool opens, not just the first
+            init=init_connection
         )
-        
-        # Register vector extension for all connections
-        async with _db_pool.acquire() as conn:
-            await register_vector(conn)
     
     return _db_pool
 
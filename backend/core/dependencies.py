@@ -25,6 +25,14 @@ async def get_vector_store() -> VectorStore:
     return _vector_store
 
 
+async def close_vector_store() -> None:
+    """Release the vector store's listener connection, if it was created."""
+    global _vector_store
+    if _vector_store is not None:
+        await _vector_store.close()
+        _vector_store = None
+
+
 async def get_embeddings_service() -> EmbeddingsService:
     """Get embeddings service instance."""
     global _embeddings_service
@@ -33,6 +41,14 @@ async def get_embeddings_service() -> EmbeddingsService:
     return _embeddings_service
 
 
+def close_embeddings_service() -> None:
+    """Shut down the embeddings service's worker pool, if it was created."""
+    global _embeddings_service
+    if _embeddings_service is not None:
+        _embeddings_service.close()
+        _embeddings_service = None
+
+
 async def get_llm_service() -> LLMService:
     """Get LLM service instance."""
     global _llm_service
@@ -41,6 +57,14 @@ async def get_llm_service() -> LLMService:
     return _llm_service
 
 
+def close_llm_service() -> None:
+    """Shut down the LLM service's worker pool, if it was created."""
+    global _llm_service
+    if _llm_service is not None:
+        _llm_service.close()
+        _llm_service = None
+
+
 async def get_document_processor() -> DocumentProcessor:
     """Get document processor instance."""
     global _document_processor
@@ -51,6 +75,14 @@ async def get_document_processor() -> DocumentProcessor:
     return _document_processor
 
 
+async def close_document_processor() -> None:
+    """Close the document processor's HTTP session, if it was created."""
+    global _document_processor
+    if _document_processor is not None:
+        await _document_processor.close()
+        _document_processor = None
+
+
 async def get_db() -> AsyncGenerator[asyncpg.Connection, None]:
     """Get database connection for a request."""
     pool = await get_db_pool()
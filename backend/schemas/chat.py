@@ -5,7 +5,7 @@ Chat schemas for API requests and responses.
 from typing import List, Optional, Dict, Any
 from uuid import UUID
 from datetime import datetime
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class ChatSource(BaseModel):
@@ -23,7 +23,7 @@ class ChatMessage(BaseModel):
 
 
 class ChatRequest(BaseModel):
-    query: str
+    query: str = Field(..., min_length=1)
     max_results: Optional[int] = 5
     document_ids: Optional[List[UUID]] = None
     similarity_threshold: Optional[float] = 0.7
@@ -69,7 +69,7 @@ class SearchResult(BaseModel):
 
 
 class SearchRequest(BaseModel):
-    query: str
+    query: str = Field(..., min_length=1)
     document_ids: Optional[List[UUID]] = None
     max_results: Optional[int] = 10
     threshold: Optional[float] = 0.7
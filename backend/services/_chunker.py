@@ -0,0 +1,80 @@
+"""
+Chunk boundary detection for the document ingestion pipeline.
+"""
+from typing import List, Tuple
+import numpy as np
+
+# Sentence separators in priority order; all are two characters wide
+SEPARATORS = ('. ', '! ', '? ', '\n\n')
+
+
+def _separator_positions(codepoints: np.ndarray) -> List[np.ndarray]:
+    """Find the start index of every occurrence of each separator in one vectorized pass."""
+    first, second = codepoints[:-1], codepoints[1:]
+    return [
+        np.flatnonzero((first == ord(sep[0])) & (second == ord(sep[1])))
+        for sep in SEPARATORS
+    ]
+
+
+def _window_spans(text_length: int, chunk_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """Spans of fixed-size windows advancing by chunk_size - overlap (at least 1)."""
+    stride = max(chunk_size - overlap, 1)
+    count = max(-(-(text_length - chunk_size) // stride), 0) + 1
+    starts = np.arange(count, dtype=np.int64) * stride
+    return list(zip(starts.tolist(), (starts + chunk_size).tolist()))
+
+
+def find_chunk_spans(
+    text: str,
+    chunk_size: int,
+    overlap: int
+) -> List[Tuple[int, int]]:
+    """
+    Compute overlapping chunk spans, preferring to end chunks at sentence boundaries.
+
+    Separator positions are located once for the whole text, so choosing each
+    chunk's end is a binary search instead of a rescan of the chunk window.
+
+    Args:
+        text: Input text
+        chunk_size: Maximum size of each chunk in characters
+        overlap: Overlap between consecutive chunks in characters
+
+    Returns:
+        List of (start, end) character offsets; `end` may exceed len(text)
+        for the final chunk
+    """
+    text_length = len(text)
+    if not text_length:
+        return []
+
+    # UTF-32 has one code unit per character, so array indices match str indices
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    positions = _separator_positions(codepoints)
+
+    # Without separators every chunk is a plain sliding window, so all spans
+    # follow from the stride: ceil((N - K) / S) + 1 windows
+    if not any(len(sep_positions) for sep_positions in positions):
+        return _window_spans(text_length, chunk_size, overlap)
+
+    spans = []
+    start = 0
+
+    while start < text_length:
+        end = start + chunk_size
+
+        # Break after the last separator that fits entirely inside [start, end)
+        if end < text_length:
+            for sep_positions in positions:
+                i = int(np.searchsorted(sep_positions, end - 1)) - 1
+                if i >= 0 and sep_positions[i] >= start:
+                    end = int(sep_positions[i]) + 2
+                    break
+
+        spans.append((start, end))
+
+        # Move to next chunk with overlap, always making forward progress
+        start = max(end - overlap, start + 1) if end < text_length else text_length
+
+    return spans
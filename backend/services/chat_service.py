@@ -59,6 +59,7 @@ class ChatService:
             for result in search_results:
                 chunk_id, content, similarity, metadata = result
                 chunk_data = {
+                    "chunk_id": str(chunk_id),
                     "content": content,
                     "metadata": metadata
                 }
@@ -2,44 +2,474 @@
 Vector store service implementation using PostgreSQL with pgvector.
 """
 import asyncio
-import json
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import math
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple, Union
 import numpy as np
-from uuid import UUID
+from uuid import UUID, uuid4
 import asyncpg
-from pgvector.asyncpg import register_vector
 
 from ..core.config import settings
+from ..core.database import encode_jsonb
 from ..models.chunk import Chunk
+from ..utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Number of recent query vectors compared against for semantic cache hits
+_SEMANTIC_CACHE_SIZE = 256
+
+# Notified by a trigger on every write to chunks (see migration 004)
+_CHUNKS_CHANGED_CHANNEL = 'chunks_changed'
+_CHUNKS_CHANGED_TRIGGER = 'chunks_changed_write'
+# Backoff between attempts to re-open a lost listener connection, in seconds
+_MAX_RELISTEN_DELAY = 30
+
+# Documents with more chunks than this are loaded with concurrent COPYs
+_PARALLEL_COPY_THRESHOLD = 2000
+_MAX_COPY_WORKERS = 4
+_CHUNK_COPY_COLUMNS = ['id', 'document_id', 'chunk_index', 'content', 'embedding', 'metadata']
+
+# HNSW candidate list size: pgvector's default, candidates per requested result,
+# and pgvector's upper limit
+_DEFAULT_EF_SEARCH = 40
+_EF_SEARCH_PER_RESULT = 4
+_MAX_EF_SEARCH = 1000
+
+# Built by migration 003; searches only order by it once initialize() has found it
+_HALFVEC_INDEX = 'idx_chunks_embedding_halfvec'
+
+# Searches asking for more results than this stream rows through a cursor
+_CURSOR_MIN_K = 64
+_CURSOR_PREFETCH = 64
+
+_DOCUMENT_CHUNKS_QUERY = """
+    SELECT 
+        id, chunk_index, content, metadata, created_at
+    FROM chunks
+    WHERE document_id = $1
+    ORDER BY chunk_index
+"""
+# Rows fetched per round-trip when streaming a document's chunks
+_DOCUMENT_CHUNKS_PREFETCH = 1000
+
+
+def _index_distance(column: str, query: str, halfvec: bool) -> str:
+    """
+    Return the distance expression used for ORDER BY.
+    
+    It has to match the HNSW index expression for the index to be used. With
+    halfvec the index holds half-precision copies of the embeddings, so
+    scans read half the bytes. Scores are still computed in full precision.
+    """
+    if halfvec:
+        return f"{column}::halfvec(1536) <=> {query}::halfvec(1536)"
+    return f"{column} <=> {query}"
+
+
+def _similarity_query(has_filter: bool, has_threshold: bool, halfvec: bool = False) -> str:
+    """
+    Build the similarity search SQL for one combination of optional filters.
+    
+    The distance is computed once in the subquery and reused for the score
+    and the threshold.
+    """
+    where = "WHERE c.document_id = ANY($3)" if has_filter else ""
+    threshold_param = 4 if has_filter else 3
+    outer_where = f"WHERE 1 - s.dist >= ${threshold_param}" if has_threshold else ""
+    
+    return f"""
+        SELECT
+            s.id,
+            s.content,
+            1 - s.dist AS similarity,
+            s.metadata,
+            s.document_id::text AS document_id,
+            s.chunk_index
+        FROM (
+            SELECT
+                c.id,
+                c.content,
+                c.metadata,
+                c.document_id,
+                c.chunk_index,
+                c.embedding <=> $1::vector AS dist,
+                {_index_distance("c.embedding", "$1::vector", halfvec)} AS index_dist
+            FROM chunks c
+            {where}
+        ) s
+        {outer_where}
+        ORDER BY s.index_dist
+        LIMIT $2
+    """
+
+
+def _batch_similarity_query(has_filter: bool, halfvec: bool = False) -> str:
+    """
+    Build the SQL for a top-K scan per query vector in a single statement.
+    
+    Each query vector drives its own LATERAL index scan, so the whole batch
+    costs one round-trip and one planning pass.
+    """
+    where = "WHERE document_id = ANY($3)" if has_filter else ""
+    
+    return f"""
+        SELECT
+            q.idx,
+            c.id,
+            c.content,
+            1 - c.dist AS similarity,
+            c.metadata,
+            c.document_id::text AS document_id,
+            c.chunk_index
+        FROM unnest($1::vector[]) WITH ORDINALITY AS q(v, idx)
+        CROSS JOIN LATERAL (
+            SELECT
+                id,
+                content,
+                metadata,
+                document_id,
+                chunk_index,
+                embedding <=> q.v AS dist
+            FROM chunks
+            {where}
+            ORDER BY {_index_distance("embedding", "q.v", halfvec)}
+            LIMIT $2
+        ) c
+        ORDER BY q.idx, c.dist
+    """
+
+
+def _search_result(row: asyncpg.Record) -> Tuple[UUID, str, float, Dict[str, Any]]:
+    """Convert a similarity search row to (chunk_id, content, similarity, metadata)."""
+    # The jsonb codec decodes a fresh dict per row, so it can be extended in place;
+    # document_id is already text from the query
+    metadata = row['metadata'] or {}
+    metadata['document_id'] = row['document_id']
+    metadata['chunk_index'] = row['chunk_index']
+    return (row['id'], row['content'], row['similarity'], metadata)
+
+
+class _MemoryIndex:
+    """
+    All chunk embeddings held in one in-process matrix for brute-force search.
+    
+    For small corpora a single matrix-vector product is cheaper than a round-trip
+    to pgvector. Rows are unit length, so the dot product is the cosine similarity.
+    """
+    
+    def __init__(self, capacity: int):
+        self.matrix = np.empty((capacity, 1536), dtype=np.float32)
+        self.ids: List[UUID] = []
+        self.contents: List[str] = []
+        self.document_ids: List[str] = []
+        self.chunk_indexes: List[int] = []
+        self.metadata: List[Optional[Dict[str, Any]]] = []
+    
+    def add(self, row: asyncpg.Record) -> None:
+        position = len(self.ids)
+        embedding = row['embedding']
+        norm = np.linalg.norm(embedding)
+        self.matrix[position] = embedding / norm if norm else embedding
+        self.ids.append(row['id'])
+        self.contents.append(row['content'])
+        self.document_ids.append(row['document_id'])
+        self.chunk_indexes.append(row['chunk_index'])
+        self.metadata.append(row['metadata'])
+    
+    def finish(self) -> None:
+        """Trim unused capacity and index document ids for filtering."""
+        self.matrix = self.matrix[:len(self.ids)]
+        self._document_id_array = np.array(self.document_ids, dtype=object)
+    
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        k: int,
+        filter_document_ids: Optional[List[UUID]],
+        threshold: Optional[float]
+    ) -> List[Tuple[UUID, str, float, Dict[str, Any]]]:
+        if not self.ids or k <= 0:
+            return []
+        
+        norm = np.linalg.norm(query_embedding)
+        scores = self.matrix @ (query_embedding / norm if norm else query_embedding)
+        if filter_document_ids:
+            allowed = np.isin(self._document_id_array, [str(doc_id) for doc_id in filter_document_ids])
+            scores = np.where(allowed, scores, -np.inf)
+        
+        # Partial sort: only the top k need ordering
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score == -np.inf or (threshold is not None and score < threshold):
+                break
+            results.append((
+                self.ids[i],
+                self.contents[i],
+                score,
+                {
+                    **(self.metadata[i] or {}),
+                    'document_id': self.document_ids[i],
+                    'chunk_index': self.chunk_indexes[i]
+                }
+            ))
+        return results
+
 
 class VectorStore:
     """Handles vector storage and similarity search using PostgreSQL with pgvector."""
     
     def __init__(self, pool: Optional[asyncpg.Pool] = None):
         self.pool = pool
-        self._registered = False
+        
+        # Full-precision index until initialize() finds the half-precision one
+        self._build_queries(halfvec=False)
+        
+        # Search results keyed by exact query vector and search options
+        self._search_cache = TTLCache(maxsize=settings.vector_cache_size, ttl=settings.vector_cache_ttl)
+        # Ring buffer of unit query vectors and their result cache keys, used to
+        # serve near-identical queries from the cache as well
+        self._semantic_vectors = np.zeros((_SEMANTIC_CACHE_SIZE, 1536), dtype=np.float32)
+        self._semantic_keys: List[Optional[tuple]] = [None] * _SEMANTIC_CACHE_SIZE
+        self._semantic_next = 0
+        # Bumped for every chunk write this process sees, its own or one announced
+        # by another worker through the chunks_changed notification
+        self._generation = 0
+        # Pooled connection held open to LISTEN for chunks_changed; cached results
+        # are only served while it is connected, since other workers' writes would
+        # otherwise go unnoticed
+        self._listener: Optional[asyncpg.Connection] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        
+        # Multiplier on the HNSW candidate list size; raise it to trade latency for recall
+        self.scan_quality = 1.0
+        
+        # Optional in-process copy of every embedding (settings.vector_in_memory_index);
+        # None while disabled, too large, or being reloaded after a write
+        self._memory_index: Optional[_MemoryIndex] = None
+        self._memory_index_task: Optional[asyncio.Task] = None
+    
+    def _build_queries(self, halfvec: bool) -> None:
+        # Fixed SQL text per (has_filter, has_threshold) so asyncpg's per-connection
+        # statement cache, which is keyed on the query text, skips parse and plan
+        # after the first call. conn.prepare() would bypass that cache.
+        self._sql_variants: Dict[Tuple[bool, bool], str] = {
+            (has_filter, has_threshold): _similarity_query(has_filter, has_threshold, halfvec)
+            for has_filter in (False, True)
+            for has_threshold in (False, True)
+        }
+        self._batch_sql_variants: Dict[bool, str] = {
+            has_filter: _batch_similarity_query(has_filter, halfvec)
+            for has_filter in (False, True)
+        }
     
     async def initialize(self) -> None:
-        """Initialize the vector store and register pgvector extension."""
+        """
+        Initialize the vector store.
+        
+        The pgvector codec is registered by the pool's `init` callback (see
+        core.database.get_db_pool), so every pooled connection already has it.
+        """
         if not self.pool:
             raise RuntimeError("Database pool not set")
         
-        if not self._registered:
-            # Register pgvector extension with asyncpg
-            async with self.pool.acquire() as conn:
-                await register_vector(conn)
-            self._registered = True
-            logger.info("pgvector extension registered")
+        if settings.vector_halfvec_index:
+            await self._check_halfvec_index()
+        
+        if settings.vector_cache_size > 0 or settings.vector_in_memory_index:
+            await self._listen()
+        
+        if settings.vector_in_memory_index:
+            await self._load_memory_index()
+    
+    async def close(self) -> None:
+        """Stop listening for chunk writes and return the listener connection to the pool."""
+        for task in (self._listener_task, self._memory_index_task):
+            if task is not None:
+                task.cancel()
+        
+        conn, self._listener = self._listener, None
+        if conn is not None:
+            conn.remove_termination_listener(self._on_listener_lost)
+            await conn.remove_listener(_CHUNKS_CHANGED_CHANNEL, self._on_chunks_changed)
+            await self.pool.release(conn)
+    
+    async def _check_halfvec_index(self) -> None:
+        """
+        Order searches by the half-precision index if it exists and is valid.
+        
+        The index can only exist on pgvector >= 0.7, so this also covers the
+        extension version. A failed concurrent build leaves an invalid index,
+        which the planner ignores.
+        """
+        async with self.pool.acquire() as conn:
+            valid = await conn.fetchval(
+                """
+                SELECT i.indisvalid
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = $1
+                """,
+                _HALFVEC_INDEX
+            )
+        
+        if valid:
+            self._build_queries(halfvec=True)
+        else:
+            logger.warning(
+                f"{_HALFVEC_INDEX} not found or invalid, searching the full-precision "
+                f"embeddings; run migrations"
+            )
+    
+    async def _listen(self) -> bool:
+        """
+        Hold a pooled connection that LISTENs for chunk writes made by any worker.
+        
+        Returns:
+            False if the chunks_changed trigger is missing, in which case
+            nothing is cached
+        """
+        conn = await self.pool.acquire()
+        try:
+            installed = await conn.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = $1)",
+                _CHUNKS_CHANGED_TRIGGER
+            )
+            if not installed:
+                logger.warning("chunks_changed trigger not found, search caching disabled; run migrations")
+                await self.pool.release(conn)
+                return False
+            
+            await conn.add_listener(_CHUNKS_CHANGED_CHANNEL, self._on_chunks_changed)
+            conn.add_termination_listener(self._on_listener_lost)
+        except BaseException:
+            await self.pool.release(conn)
+            raise
+        
+        self._listener = conn
+        return True
+    
+    def _on_chunks_changed(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        self._invalidate_search_cache()
+    
+    def _on_listener_lost(self, conn: asyncpg.Connection) -> None:
+        logger.warning("Lost the chunks_changed listener connection, search caching paused")
+        # The callback gets the bare connection, but the pool takes back its proxy
+        lost, self._listener = self._listener, None
+        self._invalidate_search_cache()
+        if lost is not None and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._relisten(lost))
+    
+    async def _relisten(self, lost: asyncpg.Connection) -> None:
+        """Re-open the listener connection, backing off while the database is unreachable."""
+        try:
+            await self.pool.release(lost)
+            delay = 1
+            while True:
+                try:
+                    if await self._listen():
+                        # Writes made while nothing was listening went unannounced
+                        self._invalidate_search_cache()
+                    return
+                except (OSError, asyncpg.PostgresError) as e:
+                    logger.warning(f"Failed to re-open the chunks_changed listener: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, _MAX_RELISTEN_DELAY)
+        except Exception as e:
+            # e.g. the pool was closed at shutdown
+            logger.error(f"Stopped re-opening the chunks_changed listener: {e}")
+        finally:
+            self._listener_task = None
+    
+    async def verify_connection(self) -> None:
+        """
+        Check that pooled connections can reach pgvector through the binary codec.
+        
+        Raises:
+            RuntimeError: If the vector codec is not registered on the connection
+        """
+        async with self.pool.acquire() as conn:
+            value = await conn.fetchval("SELECT '[1,2,3]'::vector")
+        if not isinstance(value, np.ndarray):
+            raise RuntimeError("pgvector codec is not registered on pool connections")
+    
+    async def _load_memory_index(self) -> bool:
+        """
+        Load all chunk embeddings into memory for brute-force search.
+        
+        Returns:
+            False if chunks were written while loading and the load was discarded
+        """
+        if self._listener is None:
+            # Writes made by other workers would go unnoticed
+            logger.warning("In-memory index disabled: not listening for chunk writes")
+            self._memory_index = None
+            return True
+        
+        generation = self._generation
+        
+        async with self.pool.acquire() as conn:
+            # One snapshot for the count and the rows
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                count = await conn.fetchval("SELECT COUNT(*) FROM chunks")
+                if count > settings.vector_in_memory_max_chunks:
+                    logger.info(
+                        f"In-memory index disabled: {count} chunks exceeds "
+                        f"{settings.vector_in_memory_max_chunks}"
+                    )
+                    self._memory_index = None
+                    return True
+                
+                index = _MemoryIndex(count)
+                async for row in conn.cursor(
+                    """
+                    SELECT id, content, document_id::text AS document_id, chunk_index, metadata, embedding
+                    FROM chunks
+                    WHERE embedding IS NOT NULL
+                    """,
+                    prefetch=1000
+                ):
+                    index.add(row)
+                index.finish()
+        
+        # Discard the snapshot if chunks changed while it was loading
+        if generation != self._generation:
+            return False
+        
+        self._memory_index = index
+        logger.info(f"Loaded {len(index.ids)} chunks into the in-memory index")
+        return True
+    
+    async def _reload_memory_index(self) -> None:
+        """
+        Reload the in-memory index once chunk writes have settled.
+        
+        Every write restarts the wait, so a burst of writes costs one full read
+        of the chunks table instead of one per write. Searches go to the
+        database meanwhile.
+        """
+        try:
+            while True:
+                generation = self._generation
+                await asyncio.sleep(settings.vector_in_memory_reload_delay)
+                if generation == self._generation and await self._load_memory_index():
+                    return
+        except Exception as e:
+            logger.error(f"Failed to reload in-memory index: {e}")
+        finally:
+            self._memory_index_task = None
     
     async def upsert_vectors(
         self,
         document_id: UUID,
         chunks: List[str],
-        embeddings: List[np.ndarray],
+        embeddings: Union[np.ndarray, List[np.ndarray]],
         metadata: Optional[Dict[str, Any]] = None
     ) -> List[UUID]:
         """
@@ -48,52 +478,159 @@ class VectorStore:
         Args:
             document_id: UUID of the parent document
             chunks: List of text chunks
-            embeddings: List of embedding vectors (1536 dimensions)
+            embeddings: Embedding matrix of shape (N, 1536) or list of vectors
             metadata: Optional metadata for all chunks
             
         Returns:
             List of chunk IDs created
         """
-        if len(chunks) != len(embeddings):
-            raise ValueError("Number of chunks must match number of embeddings")
+        chunk_ids, records = self._chunk_records(document_id, chunks, embeddings, metadata)
+        
+        if len(records) <= _PARALLEL_COPY_THRESHOLD:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    # Delete existing chunks for this document (if re-processing)
+                    await conn.execute(
+                        "DELETE FROM chunks WHERE document_id = $1",
+                        document_id
+                    )
+                    
+                    # Insert all chunks in a single COPY instead of one round-trip per row
+                    await conn.copy_records_to_table(
+                        'chunks',
+                        records=records,
+                        columns=_CHUNK_COPY_COLUMNS
+                    )
+        else:
+            await self._parallel_copy(document_id, records)
+        
+        logger.info(f"Inserted {len(chunk_ids)} chunks for document {document_id}")
+        
+        self._invalidate_search_cache()
+        return chunk_ids
+    
+    async def upsert_documents(
+        self,
+        documents: List[Tuple[UUID, List[str], Union[np.ndarray, List[np.ndarray]], Optional[Dict[str, Any]]]]
+    ) -> List[List[UUID]]:
+        """
+        Store the chunks of several documents in one transaction.
+        
+        All documents share a single pooled connection, one DELETE and one
+        COPY, instead of a connection and transaction per document.
+        
+        Args:
+            documents: (document_id, chunks, embeddings, metadata) tuples
+            
+        Returns:
+            List of chunk IDs created, one list per document
+        """
+        all_chunk_ids = []
+        records = []
+        for document_id, chunks, embeddings, metadata in documents:
+            chunk_ids, document_records = self._chunk_records(document_id, chunks, embeddings, metadata)
+            all_chunk_ids.append(chunk_ids)
+            records.extend(document_records)
         
-        chunk_ids = []
+        if not documents:
+            return all_chunk_ids
         
+        document_ids = [document[0] for document in documents]
         async with self.pool.acquire() as conn:
             async with conn.transaction():
-                # Delete existing chunks for this document (if re-processing)
                 await conn.execute(
-                    "DELETE FROM chunks WHERE document_id = $1",
-                    document_id
+                    "DELETE FROM chunks WHERE document_id = ANY($1::uuid[])",
+                    document_ids
                 )
-                
-                # Insert new chunks
-                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                    # Ensure embedding is numpy array with correct shape
-                    if isinstance(embedding, list):
-                        embedding = np.array(embedding)
-                    
-                    if embedding.shape != (1536,):
-                        raise ValueError(f"Embedding must have 1536 dimensions, got {embedding.shape}")
-                    
-                    # Insert chunk with embedding
-                    chunk_id = await conn.fetchval(
-                        """
-                        INSERT INTO chunks (document_id, chunk_index, content, embedding, metadata)
-                        VALUES ($1, $2, $3, $4, $5)
-                        RETURNING id
-                        """,
-                        document_id,
-                        i,
-                        chunk,
-                        embedding.tolist(),  # pgvector expects list, not numpy array
-                        json.dumps(metadata) if metadata else None
+                if records:
+                    await conn.copy_records_to_table(
+                        'chunks',
+                        records=records,
+                        columns=_CHUNK_COPY_COLUMNS
                     )
-                    chunk_ids.append(chunk_id)
-                
-                logger.info(f"Inserted {len(chunk_ids)} chunks for document {document_id}")
         
-        return chunk_ids
+        logger.info(f"Inserted {len(records)} chunks for {len(documents)} documents")
+        
+        self._invalidate_search_cache()
+        return all_chunk_ids
+    
+    @staticmethod
+    def _chunk_records(
+        document_id: UUID,
+        chunks: List[str],
+        embeddings: Union[np.ndarray, List[np.ndarray]],
+        metadata: Optional[Dict[str, Any]]
+    ) -> Tuple[List[UUID], List[tuple]]:
+        """Validate a document's chunks and build its COPY records."""
+        if len(chunks) != len(embeddings):
+            raise ValueError("Number of chunks must match number of embeddings")
+        
+        # Stack and validate the whole batch at once; the pgvector binary codec
+        # serializes each float32 row view as a single buffer
+        if chunks:
+            matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        else:
+            matrix = np.empty((0, 1536), dtype=np.float32)
+        if matrix.shape != (len(chunks), 1536):
+            raise ValueError(
+                f"Embeddings must have shape ({len(chunks)}, 1536), got {matrix.shape}"
+            )
+        
+        # Generate ids client-side so the rows can be bulk loaded with COPY
+        chunk_ids = [uuid4() for _ in chunks]
+        # Document-level metadata is identical for every row, so serialize it once
+        metadata_jsonb = encode_jsonb(metadata) if metadata else None
+        
+        records = [
+            (chunk_id, document_id, i, chunk, embedding, metadata_jsonb)
+            for i, (chunk_id, chunk, embedding) in enumerate(zip(chunk_ids, chunks, matrix))
+        ]
+        return chunk_ids, records
+    
+    async def _parallel_copy(self, document_id: UUID, records: List[tuple]) -> None:
+        """
+        Load a large document's chunks as several concurrent COPYs.
+        
+        Each shard is COPYed on its own pooled connection into an unlogged
+        staging table. The document's old chunks are then replaced from it in
+        one transaction, so a failed load leaves them untouched.
+        """
+        workers = max(1, min(self.pool.get_max_size() - 1, _MAX_COPY_WORKERS))
+        shard_size = -(-len(records) // workers)
+        shards = [records[i:i + shard_size] for i in range(0, len(records), shard_size)]
+        # Temporary tables are private to one session, so the shards need a real table
+        staging = f"chunks_load_{uuid4().hex}"
+        columns = ", ".join(_CHUNK_COPY_COLUMNS)
+        
+        async def copy_shard(shard: List[tuple]) -> None:
+            async with self.pool.acquire() as conn:
+                await conn.copy_records_to_table(staging, records=shard, columns=_CHUNK_COPY_COLUMNS)
+        
+        async with self.pool.acquire() as conn:
+            # Same columns and NOT NULL constraints as chunks, but no indexes to maintain
+            await conn.execute(f"CREATE UNLOGGED TABLE {staging} (LIKE chunks INCLUDING DEFAULTS)")
+        
+        tasks = [asyncio.ensure_future(copy_shard(shard)) for shard in shards]
+        try:
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop the remaining shards before the staging table is dropped
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                logger.error(f"Parallel COPY failed for document {document_id}, keeping its old chunks")
+                raise
+            
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM chunks WHERE document_id = $1", document_id)
+                    await conn.execute(
+                        f"INSERT INTO chunks ({columns}) SELECT {columns} FROM {staging}"
+                    )
+        finally:
+            async with self.pool.acquire() as conn:
+                await conn.execute(f"DROP TABLE IF EXISTS {staging}")
     
     async def similarity_search(
         self,
@@ -114,60 +651,184 @@ class VectorStore:
         Returns:
             List of tuples: (chunk_id, content, similarity_score, metadata)
         """
-        if isinstance(query_embedding, list):
-            query_embedding = np.array(query_embedding)
-        
+        query_embedding = np.ascontiguousarray(query_embedding, dtype=np.float32)
         if query_embedding.shape != (1536,):
             raise ValueError(f"Query embedding must have 1536 dimensions, got {query_embedding.shape}")
         
-        # Build query with optional filters
-        query = """
-            SELECT 
-                c.id,
-                c.content,
-                1 - (c.embedding <=> $1) as similarity,
-                c.metadata,
-                c.document_id
-            FROM chunks c
-            WHERE 1=1
-        """
-        
-        params = [query_embedding.tolist()]
-        param_count = 1
+        options = (k, tuple(sorted(filter_document_ids or ())), threshold)
+        cache_key = (hashlib.blake2b(query_embedding.tobytes(), digest_size=16).digest(), *options)
         
+        # $1 is the query vector and $2 the limit; filters follow in order
+        params = [query_embedding, k]
         if filter_document_ids:
-            param_count += 1
-            query += f" AND c.document_id = ANY(${param_count})"
             params.append(filter_document_ids)
-        
         if threshold is not None:
-            param_count += 1
-            query += f" AND 1 - (c.embedding <=> $1) >= ${param_count}"
             params.append(threshold)
+        query = self._sql_variants[(bool(filter_document_ids), threshold is not None)]
         
-        query += f"""
-            ORDER BY c.embedding <=> $1
-            LIMIT ${param_count + 1}
-        """
-        params.append(k)
+        # Writes, including other workers', reset the cache and the in-memory index
+        # through the listener, so serving from them needs no database round-trip
+        generation = self._generation
+        cacheable = self._listener is not None
+        
+        if cacheable and self._memory_index is not None:
+            return self._memory_index.search(query_embedding, k, filter_document_ids, threshold)
+        
+        if cacheable and settings.vector_cache_size > 0:
+            cached = self._cached_search(cache_key, query_embedding)
+            if cached is not None:
+                logger.debug("Similarity search served from cache")
+                return list(cached)
         
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(query, *params)
-            
-            results = []
-            for row in rows:
-                results.append((
-                    row['id'],
-                    row['content'],
-                    row['similarity'],
-                    {
-                        **(json.loads(row['metadata']) if row['metadata'] else {}),
-                        'document_id': str(row['document_id'])
-                    }
-                ))
+            ef_search = self._ef_search(k)
+            if k > _CURSOR_MIN_K or ef_search:
+                results = []
+                async with conn.transaction():
+                    if ef_search:
+                        await self._set_ef_search(conn, ef_search)
+                    if k > _CURSOR_MIN_K:
+                        # Convert rows as they arrive instead of buffering every record first
+                        async for row in conn.cursor(query, *params, prefetch=_CURSOR_PREFETCH):
+                            results.append(_search_result(row))
+                    else:
+                        results = [_search_result(row) for row in await conn.fetch(query, *params)]
+            else:
+                rows = await conn.fetch(query, *params)
+                results = [_search_result(row) for row in rows]
             
             logger.info(f"Found {len(results)} similar chunks")
+        
+        # Skip caching if chunks changed, or the listener was lost, while the search ran
+        if cacheable and generation == self._generation:
+            self._remember_search(cache_key, query_embedding, results)
+        return list(results)
+    
+    def _ef_search(self, k: int) -> Optional[int]:
+        """
+        Return the HNSW candidate list size to use for a top-k search.
+        
+        Returns None when pgvector's default already covers it, so the search
+        needs no transaction or extra statement.
+        """
+        ef_search = math.ceil(_EF_SEARCH_PER_RESULT * k * self.scan_quality)
+        if ef_search <= _DEFAULT_EF_SEARCH:
+            return None
+        return min(ef_search, _MAX_EF_SEARCH)
+    
+    @staticmethod
+    async def _set_ef_search(conn: asyncpg.Connection, ef_search: int) -> None:
+        # Transaction-local, so it never leaks to the next user of the pooled connection
+        await conn.execute("SELECT set_config('hnsw.ef_search', $1, true)", str(ef_search))
+    
+    def _cached_search(
+        self,
+        cache_key: tuple,
+        query_embedding: np.ndarray
+    ) -> Optional[List[Tuple[UUID, str, float, Dict[str, Any]]]]:
+        """Look up results for this exact query, then for a near-identical one."""
+        results = self._search_cache.get(cache_key)
+        if results is not None or not self._semantic_cache_enabled:
             return results
+        
+        norm = np.linalg.norm(query_embedding)
+        if not norm:
+            return None
+        
+        similarities = self._semantic_vectors @ (query_embedding / norm)
+        for index in np.flatnonzero(similarities >= settings.vector_semantic_cache_threshold):
+            key = self._semantic_keys[index]
+            # Only reuse results that were fetched with the same k, filters and threshold
+            if key is not None and key[1:] == cache_key[1:]:
+                results = self._search_cache.get(key)
+                if results is not None:
+                    return results
+        
+        return None
+    
+    def _remember_search(
+        self,
+        cache_key: tuple,
+        query_embedding: np.ndarray,
+        results: List[Tuple[UUID, str, float, Dict[str, Any]]]
+    ) -> None:
+        """Cache search results and index the query vector for semantic hits."""
+        self._search_cache.set(cache_key, results)
+        if not self._semantic_cache_enabled:
+            return
+        
+        norm = np.linalg.norm(query_embedding)
+        if not norm:
+            return
+        
+        slot = self._semantic_next
+        self._semantic_vectors[slot] = query_embedding / norm
+        self._semantic_keys[slot] = cache_key
+        self._semantic_next = (slot + 1) % _SEMANTIC_CACHE_SIZE
+    
+    @property
+    def _semantic_cache_enabled(self) -> bool:
+        return settings.vector_cache_size > 0 and settings.vector_semantic_cache_threshold <= 1
+    
+    def _invalidate_search_cache(self) -> None:
+        """Drop cached search results after the stored chunks change."""
+        self._generation += 1
+        self._search_cache.clear()
+        self._semantic_keys = [None] * _SEMANTIC_CACHE_SIZE
+        
+        if settings.vector_in_memory_index:
+            # Searches go to the database until the in-memory index is reloaded
+            self._memory_index = None
+            if self._listener is not None and self._memory_index_task is None:
+                self._memory_index_task = asyncio.create_task(self._reload_memory_index())
+    
+    async def similarity_search_batch(
+        self,
+        query_embeddings: Union[np.ndarray, List[np.ndarray]],
+        k: int = 5,
+        filter_document_ids: Optional[List[UUID]] = None
+    ) -> List[List[Tuple[UUID, str, float, Dict[str, Any]]]]:
+        """
+        Perform similarity search for several query embeddings in one round-trip.
+        
+        Args:
+            query_embeddings: Query matrix of shape (Q, 1536) or list of vectors
+            k: Number of results to return per query
+            filter_document_ids: Optional list of document IDs to filter by
+            
+        Returns:
+            One result list per query, in input order, each with tuples of
+            (chunk_id, content, similarity_score, metadata)
+        """
+        if len(query_embeddings) == 0:
+            return []
+        
+        matrix = np.ascontiguousarray(query_embeddings, dtype='>f4')
+        if matrix.ndim != 2 or matrix.shape[1] != 1536:
+            raise ValueError(f"Query embeddings must have shape (Q, 1536), got {matrix.shape}")
+        
+        # asyncpg treats nested sequences as extra array dimensions, so each
+        # row is passed as a memoryview, which the vector codec reads as-is
+        params = [[memoryview(row) for row in matrix], k]
+        if filter_document_ids:
+            params.append(filter_document_ids)
+        query = self._batch_sql_variants[bool(filter_document_ids)]
+        
+        async with self.pool.acquire() as conn:
+            ef_search = self._ef_search(k)
+            if ef_search:
+                async with conn.transaction():
+                    await self._set_ef_search(conn, ef_search)
+                    rows = await conn.fetch(query, *params)
+            else:
+                rows = await conn.fetch(query, *params)
+        
+        results: List[List[Tuple[UUID, str, float, Dict[str, Any]]]] = [[] for _ in range(len(matrix))]
+        for row in rows:
+            results[row['idx'] - 1].append(_search_result(row))
+        
+        logger.info(f"Found {len(rows)} similar chunks for {len(matrix)} queries")
+        return results
     
     async def get_document_chunks(
         self,
@@ -183,19 +844,36 @@ class VectorStore:
             List of chunk data dictionaries
         """
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                """
-                SELECT 
-                    id, chunk_index, content, chunk_metadata, created_at
-                FROM chunks
-                WHERE document_id = $1
-                ORDER BY chunk_index
-                """,
-                document_id
-            )
+            rows = await conn.fetch(_DOCUMENT_CHUNKS_QUERY, document_id)
             
             return [dict(row) for row in rows]
     
+    async def stream_document_chunks(
+        self,
+        document_id: UUID
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the chunks of a document in order through a server-side cursor.
+        
+        Unlike get_document_chunks, only one prefetch batch of rows is held in
+        memory at a time, and callers can stop early.
+        
+        Args:
+            document_id: UUID of the document
+            
+        Yields:
+            Chunk data dictionaries
+        """
+        async with self.pool.acquire() as conn:
+            # Cursors only exist inside a transaction
+            async with conn.transaction():
+                async for row in conn.cursor(
+                    _DOCUMENT_CHUNKS_QUERY,
+                    document_id,
+                    prefetch=_DOCUMENT_CHUNKS_PREFETCH
+                ):
+                    yield dict(row)
+    
     async def delete_document_vectors(self, document_id: UUID) -> int:
         """
         Delete all vectors for a specific document.
@@ -207,10 +885,13 @@ class VectorStore:
             Number of chunks deleted
         """
         async with self.pool.acquire() as conn:
-            count = await conn.fetchval(
-                "DELETE FROM chunks WHERE document_id = $1 RETURNING COUNT(*)",
+            # The command tag is "DELETE <n>", so no second query is needed for the count
+            status = await conn.execute(
+                "DELETE FROM chunks WHERE document_id = $1",
                 document_id
             )
+            count = int(status.split()[-1])
+            self._invalidate_search_cache()
             logger.info(f"Deleted {count} chunks for document {document_id}")
             return count
     
@@ -230,7 +911,7 @@ class VectorStore:
             await conn.execute(
                 """
                 UPDATE chunks 
-                SET chunk_metadata = COALESCE(chunk_metadata, '{}'::jsonb) || $2
+                SET metadata = COALESCE(metadata, '{}'::jsonb) || $2
                 WHERE id = $1
                 """,
                 chunk_id,
@@ -240,16 +921,34 @@ class VectorStore:
     async def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector store."""
         async with self.pool.acquire() as conn:
-            stats = await conn.fetchrow(
-                """
-                SELECT 
-                    COUNT(DISTINCT document_id) as document_count,
-                    COUNT(*) as chunk_count,
-                    AVG(length(content)) as avg_chunk_length,
-                    MAX(created_at) as last_indexed
-                FROM chunks
-                """
-            )
+            stats = None
+            if settings.vector_stats_table:
+                try:
+                    # Maintained by triggers on chunks; one row per document
+                    stats = await conn.fetchrow(
+                        """
+                        SELECT 
+                            COUNT(*) as document_count,
+                            SUM(chunk_count) as chunk_count,
+                            SUM(total_length)::float / NULLIF(SUM(chunk_count), 0) as avg_chunk_length,
+                            MAX(last_indexed) as last_indexed
+                        FROM chunk_stats
+                        """
+                    )
+                except asyncpg.UndefinedTableError:
+                    logger.warning("chunk_stats table not found, computing stats from chunks")
+            
+            if stats is None:
+                stats = await conn.fetchrow(
+                    """
+                    SELECT 
+                        COUNT(DISTINCT document_id) as document_count,
+                        COUNT(*) as chunk_count,
+                        AVG(length(content)) as avg_chunk_length,
+                        MAX(created_at) as last_indexed
+                    FROM chunks
+                    """
+                )
             
             # Check index stats
             index_info = await conn.fetch(
@@ -264,7 +963,7 @@ class VectorStore:
             
             return {
                 "document_count": stats['document_count'] or 0,
-                "chunk_count": stats['chunk_count'] or 0,
+                "chunk_count": int(stats['chunk_count'] or 0),
                 "avg_chunk_length": float(stats['avg_chunk_length'] or 0),
                 "last_indexed": stats['last_indexed'],
                 "indexes": [dict(row) for row in index_info]
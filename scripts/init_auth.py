@@ -20,30 +20,8 @@ logger = get_logger(__name__)
 
 async def init_auth_tables():
     """Initialize authentication-related tables."""
-    # Parse connection parameters
-    db_url = settings.database_url
-    if db_url.startswith("postgresql://"):
-        db_url = db_url[13:]  # Remove postgresql://
-    
-    user_pass, host_db = db_url.split("@")
-    user, password = user_pass.split(":")
-    host_port, db_name = host_db.split("/")
-    
-    if ":" in host_port:
-        host, port = host_port.split(":")
-        port = int(port)
-    else:
-        host = host_port
-        port = 5432
-    
-    # Connect to database
-    conn = await asyncpg.connect(
-        host=host,
-        port=port,
-        user=user,
-        password=password,
-        database=db_name
-    )
+    # asyncpg parses the DSN itself, including URL-encoded credentials
+    conn = await asyncpg.connect(settings.database_url)
     
     try:
         # Read and execute SQL migration
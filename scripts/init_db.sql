@@ -47,8 +47,10 @@ CREATE INDEX idx_chunks_document_id ON chunks(document_id);
 CREATE INDEX idx_audit_log_user_id ON audit_log(user_id);
 CREATE INDEX idx_audit_log_created_at ON audit_log(created_at DESC);
 
--- Create HNSW index for vector similarity search
-CREATE INDEX idx_chunks_embedding ON chunks USING hnsw (embedding vector_cosine_ops)
+-- Create HNSW index for vector similarity search over half-precision copies
+-- of the embeddings; scores are still computed from the full-precision column
+CREATE INDEX idx_chunks_embedding_halfvec ON chunks
+USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops)
 WITH (m = 16, ef_construction = 64);
 
 -- Function to update updated_at timestamp
@@ -63,4 +65,83 @@ $$ language 'plpgsql';
 -- Create trigger for documents table
 CREATE TRIGGER update_documents_updated_at BEFORE UPDATE
     ON documents FOR EACH ROW EXECUTE FUNCTION 
-    update_updated_at_column();
\ No newline at end of file
+    update_updated_at_column();
+
+-- Per-document chunk statistics maintained by triggers, so get_stats does not
+-- have to scan every chunk
+CREATE TABLE IF NOT EXISTS chunk_stats (
+    document_id UUID PRIMARY KEY,
+    chunk_count BIGINT NOT NULL DEFAULT 0,
+    total_length BIGINT NOT NULL DEFAULT 0,
+    last_indexed TIMESTAMP WITH TIME ZONE
+);
+
+CREATE OR REPLACE FUNCTION chunk_stats_after_insert()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO chunk_stats (document_id, chunk_count, total_length, last_indexed)
+    SELECT document_id, COUNT(*), SUM(length(content)), MAX(created_at)
+    FROM new_chunks
+    GROUP BY document_id
+    ON CONFLICT (document_id) DO UPDATE SET
+        chunk_count = chunk_stats.chunk_count + EXCLUDED.chunk_count,
+        total_length = chunk_stats.total_length + EXCLUDED.total_length,
+        last_indexed = GREATEST(chunk_stats.last_indexed, EXCLUDED.last_indexed);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION chunk_stats_after_delete()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE chunk_stats s SET
+        chunk_count = s.chunk_count - d.chunk_count,
+        total_length = s.total_length - d.total_length
+    FROM (
+        SELECT document_id, COUNT(*) AS chunk_count, SUM(length(content)) AS total_length
+        FROM old_chunks
+        GROUP BY document_id
+    ) d
+    WHERE s.document_id = d.document_id;
+    
+    DELETE FROM chunk_stats WHERE chunk_count <= 0;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION chunk_stats_after_truncate()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM chunk_stats;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+-- Statement-level triggers see a whole COPY/DELETE batch at once
+CREATE TRIGGER chunk_stats_insert AFTER INSERT ON chunks
+    REFERENCING NEW TABLE AS new_chunks
+    FOR EACH STATEMENT EXECUTE FUNCTION chunk_stats_after_insert();
+
+CREATE TRIGGER chunk_stats_delete AFTER DELETE ON chunks
+    REFERENCING OLD TABLE AS old_chunks
+    FOR EACH STATEMENT EXECUTE FUNCTION chunk_stats_after_delete();
+
+CREATE TRIGGER chunk_stats_truncate AFTER TRUNCATE ON chunks
+    FOR EACH STATEMENT EXECUTE FUNCTION chunk_stats_after_truncate();
+
+-- Every write to chunks notifies chunks_changed; each worker process LISTENs
+-- for it and drops its cached search results and in-memory index. NOTIFY
+-- takes no row lock and is only delivered once the writer commits.
+CREATE OR REPLACE FUNCTION chunks_changed_notify()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('chunks_changed', '');
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER chunks_changed_write AFTER INSERT OR UPDATE OR DELETE ON chunks
+    FOR EACH STATEMENT EXECUTE FUNCTION chunks_changed_notify();
+
+CREATE TRIGGER chunks_changed_truncate AFTER TRUNCATE ON chunks
+    FOR EACH STATEMENT EXECUTE FUNCTION chunks_changed_notify();
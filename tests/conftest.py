@@ -3,40 +3,69 @@ Pytest configuration and fixtures.
 """
 
 import os
+import hashlib
 import pytest
-import asyncio
-from typing import AsyncGenerator, Generator
+from typing import AsyncGenerator, Dict
 from unittest.mock import Mock, AsyncMock
 import numpy as np
 from uuid import uuid4
 
 import asyncpg
-from httpx import AsyncClient
+from httpx import ASGITransport, AsyncClient
+from pytest_asyncio import is_async_test
 
 from backend.app import app
 from backend.core.config import settings
-from backend.core.database import get_db_pool
+from backend.core.database import get_db_pool, init_connection
 from backend.services.vector_store import VectorStore
 from backend.services.embeddings import EmbeddingsService
 from backend.services.llm import LLMService
 from backend.services.document_processor import DocumentProcessor
 
+# Mock embeddings keyed by a hash of the text, so each text always gets the same vector
+_EMB_CACHE: Dict[bytes, np.ndarray] = {}
 
-@pytest.fixture(scope="session")
-def event_loop() -> Generator:
-    """Create event loop for async tests."""
-    loop = asyncio.get_event_loop_policy().new_event_loop()
-    yield loop
-    loop.close()
 
+def _mock_embedding(text: str) -> np.ndarray:
+    """Return a deterministic random 1536-dimensional embedding for `text`."""
+    key = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    embedding = _EMB_CACHE.get(key)
+    if embedding is None:
+        rng = np.random.default_rng(seed=int.from_bytes(key, "little"))
+        embedding = _EMB_CACHE[key] = rng.random(1536, dtype=np.float32)
+    return embedding
 
-@pytest.fixture
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-benchmarks",
+        action="store_true",
+        help="run the wall-clock latency benchmarks, which depend on the machine"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Run every async test in the session event loop shared with the session fixtures."""
+    session_loop = pytest.mark.asyncio(loop_scope="session")
+    # Timing asserts flake on loaded CI machines, so benchmarks are opt-in
+    skip_benchmark = None
+    if not config.getoption("--run-benchmarks"):
+        skip_benchmark = pytest.mark.skip(reason="benchmark; pass --run-benchmarks to run it")
+    for item in items:
+        if is_async_test(item):
+            item.add_marker(session_loop, append=False)
+        if skip_benchmark is not None and "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
+@pytest.fixture(scope="session")
 async def db_pool():
-    """Create test database pool."""
+    """Create one test database pool shared by the whole session."""
     pool = await asyncpg.create_pool(
         settings.database_url.replace("/brain", "/brain_test"),
         min_size=1,
         max_size=5,
+        init=init_connection,
     )
     yield pool
     await pool.close()
@@ -44,19 +73,32 @@ async def db_pool():
 
 @pytest.fixture
 async def clean_db(db_pool):
-    """Clean database before each test."""
+    """Clean database before each test; the pool is shared, so this provides isolation."""
     async with db_pool.acquire() as conn:
         await conn.execute("TRUNCATE TABLE documents, chunks, audit_log CASCADE")
     yield
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 async def client() -> AsyncGenerator[AsyncClient, None]:
-    """Create async test client."""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
+    """
+    Create one async test client shared by the whole session.
+    
+    The ASGI transport calls the app in-process and does not run lifespan
+    events; per-test state lives in app.dependency_overrides, which
+    reset_dependency_overrides clears after every test.
+    """
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
         yield ac
 
 
+@pytest.fixture(autouse=True)
+def reset_dependency_overrides():
+    """Drop any dependency overrides a test installed on the app."""
+    yield
+    app.dependency_overrides.clear()
+
+
 @pytest.fixture
 def mock_embeddings_service():
     """Mock embeddings service."""
@@ -64,20 +106,21 @@ def mock_embeddings_service():
     
     # Mock embedding generation
     async def mock_generate_embeddings(texts, normalize=True):
-        embeddings = []
-        for _ in texts:
-            # Generate random 1536-dimensional embedding
-            embedding = np.random.rand(1536)
-            if normalize:
-                embedding = embedding / np.linalg.norm(embedding)
-            embeddings.append(embedding)
+        # Same (n, 1536) float32 matrix the real service returns
+        if not texts:
+            return np.empty((0, 1536), dtype=np.float32)
+        # Stack the cached per-text vectors and normalize them in one call
+        embeddings = np.stack([_mock_embedding(text) for text in texts])
+        if normalize:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
         return embeddings
     
+    async def mock_generate_embedding(text, normalize=True):
+        return (await mock_generate_embeddings([text], normalize))[0]
+    
     service.generate_embeddings = AsyncMock(side_effect=mock_generate_embeddings)
-    service.generate_embedding = AsyncMock(
-        side_effect=lambda text, normalize=True: mock_generate_embeddings([text], normalize)[0]
-    )
-    service.estimate_tokens = Mock(return_value=len(texts) * 10 if isinstance(texts, list) else 10)
+    service.generate_embedding = AsyncMock(side_effect=mock_generate_embedding)
+    service.estimate_tokens = AsyncMock(side_effect=lambda text: len(text) // 4)
     service.health_check = AsyncMock(return_value={"status": "healthy", "model": "mock"})
     
     return service
@@ -185,6 +228,7 @@ def sample_document():
 def sample_chunks():
     """Sample chunk data."""
     doc_id = uuid4()
+    embeddings = np.random.default_rng(0).random((3, 1536), dtype=np.float32).tolist()
     return [
         {
             "id": uuid4(),
@@ -193,7 +237,7 @@ def sample_chunks():
             "chunk_index": 0,
             "start_char": 0,
             "end_char": 50,
-            "embedding": np.random.rand(1536).tolist(),
+            "embedding": embeddings[0],
             "metadata": {"page": 1},
         },
         {
@@ -203,7 +247,7 @@ def sample_chunks():
             "chunk_index": 1,
             "start_char": 45,
             "end_char": 95,
-            "embedding": np.random.rand(1536).tolist(),
+            "embedding": embeddings[1],
             "metadata": {"page": 1},
         },
         {
@@ -213,7 +257,13 @@ def sample_chunks():
             "chunk_index": 2,
             "start_char": 90,
             "end_char": 130,
-            "embedding": np.random.rand(1536).tolist(),
+            "embedding": embeddings[2],
             "metadata": {"page": 2},
         },
-    ]
\ No newline at end of file
+    ]
+
+
+@pytest.fixture
+def random_vectors():
+    """A deterministic float32 matrix of random vectors; slice rows instead of allocating each one."""
+    return np.random.default_rng(42).random((256, 1536), dtype=np.float32)
@@ -3,85 +3,188 @@ Tests for document API endpoints.
 """
 
 import pytest
-from unittest.mock import Mock, AsyncMock, patch
-from uuid import uuid4
+from unittest.mock import Mock, AsyncMock
+from uuid import UUID
 import json
 from datetime import datetime
 
 from httpx import AsyncClient
 from fastapi import status
 
+from backend.app import app
+from tests.utils import create_mock_pool
+from backend.core.config import settings
+from backend.core.auth_dependencies import get_current_active_user
+from backend.core.dependencies import get_db, get_document_processor, get_vector_store
+
+
+# Pure mocks, so the module can run beside others under pytest-xdist; the group
+# keeps it on one worker, which then builds the session-scoped mocks only once
+pytestmark = pytest.mark.xdist_group("api_documents")
+
+# Fixed timestamp for the mocked document rows
+_NOW = datetime(2024, 1, 1, 0, 0, 0)
+
+# Deterministic ids; uuid4() costs a urandom syscall for nothing here
+_UUIDS = [UUID(int=i) for i in range(32)]
+
+_TEST_USER = {"id": _UUIDS[0], "email": "test@example.com"}
+
+
+class _Record:
+    """Minimal asyncpg.Record stand-in: access by column name or index, plus get()."""
+    
+    __slots__ = ("_keys", "_values")
+    
+    def __init__(self, **columns):
+        self._keys = tuple(columns)
+        self._values = tuple(columns.values())
+    
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        try:
+            return self._values[self._keys.index(key)]
+        except ValueError:
+            raise KeyError(key) from None
+    
+    def get(self, key, default=None):
+        return self[key] if key in self._keys else default
+    
+    def keys(self):
+        return iter(self._keys)
+    
+    def values(self):
+        return iter(self._values)
+    
+    def items(self):
+        return zip(self._keys, self._values)
+    
+    def __iter__(self):
+        return iter(self._values)
+    
+    def __len__(self):
+        return len(self._values)
+
+
+def _document_row(doc_id, filename, content_type="application/pdf", file_size=1024,
+                  status="processed", s3_key="documents/123/test.pdf"):
+    """Build a documents-table row shaped like the one asyncpg returns for SELECT *."""
+    return _Record(
+        id=doc_id,
+        filename=filename,
+        original_name=filename,
+        file_size=file_size,
+        content_type=content_type,
+        status=status,
+        error_message=None,
+        s3_key=s3_key,
+        created_at=_NOW,
+        updated_at=_NOW
+    )
+
+
+_PROCESS_RESULT = {
+    "status": "processed",
+    "chunk_count": 5,
+    "s3_key": "documents/123/test.pdf",
+    "chunk_ids": [],
+    "text_length": 11
+}
+
+
+@pytest.fixture(scope="session")
+def mock_document_processor():
+    """Mock document processor service, shared by the session and reset per test."""
+    processor = Mock()
+    processor.process_document = AsyncMock()
+    processor.delete_from_s3 = AsyncMock()
+    processor.download_from_s3 = AsyncMock()
+    return processor
+
+
+@pytest.fixture(scope="session")
+def mock_pool():
+    """Mock database pool, shared by the session and reset per test."""
+    # Mock connection
+    conn = AsyncMock()
+    conn.fetchrow = AsyncMock()
+    conn.fetchval = AsyncMock()
+    conn.fetch = AsyncMock()
+    conn.execute = AsyncMock()
+    
+    # Mock transaction
+    conn.transaction = AsyncMock()
+    conn.transaction.return_value.__aenter__ = AsyncMock()
+    conn.transaction.return_value.__aexit__ = AsyncMock()
+    
+    return create_mock_pool(conn)
+
+
+@pytest.fixture(scope="session")
+def mock_vector_store():
+    """Mock vector store, shared by the session and reset per test."""
+    vector_store = Mock()
+    vector_store.delete_document_vectors = AsyncMock()
+    return vector_store
+
+
+@pytest.fixture(autouse=True)
+def _reset(mock_pool, mock_document_processor, mock_vector_store):
+    """Clear calls and per-test configuration, then restore the canonical returns."""
+    conn = mock_pool.acquire.return_value.__aenter__.return_value
+    # Reset each method directly: older Pythons don't pass return_value through to children
+    for method in (
+        conn.fetchrow,
+        conn.fetchval,
+        conn.fetch,
+        conn.execute,
+        mock_document_processor.process_document,
+        mock_document_processor.delete_from_s3,
+        mock_document_processor.download_from_s3,
+        mock_vector_store.delete_document_vectors
+    ):
+        method.reset_mock(return_value=True, side_effect=True)
+    
+    mock_document_processor.process_document.return_value = _PROCESS_RESULT
+    mock_vector_store.delete_document_vectors.return_value = 5
+
 
-@pytest.mark.asyncio
 class TestDocumentAPI:
     """Test document API endpoints."""
     
-    @pytest.fixture
-    def mock_document_processor(self):
-        """Mock document processor service."""
-        processor = Mock()
-        processor.process_document = AsyncMock(
-            return_value={
-                "status": "success",
-                "chunks_created": 5,
-                "s3_key": "documents/123/test.pdf",
-                "original_s3_key": "originals/123/test.pdf"
-            }
-        )
-        return processor
-    
-    @pytest.fixture
-    def mock_pool(self):
-        """Mock database pool."""
-        pool = Mock()
+    @pytest.fixture(autouse=True)
+    def override_dependencies(self, mock_pool, mock_document_processor, mock_vector_store):
+        """Route the document endpoints' dependencies to the mocks; cleared by conftest."""
+        async def get_mock_db():
+            yield mock_pool.acquire.return_value.__aenter__.return_value
         
-        # Mock connection
-        conn = AsyncMock()
-        conn.fetchone = AsyncMock()
-        conn.fetchval = AsyncMock()
-        conn.fetch = AsyncMock()
-        conn.execute = AsyncMock()
-        
-        # Mock transaction
-        conn.transaction = AsyncMock()
-        conn.transaction.return_value.__aenter__ = AsyncMock()
-        conn.transaction.return_value.__aexit__ = AsyncMock()
-        
-        pool.acquire = AsyncMock()
-        pool.acquire.return_value.__aenter__ = AsyncMock(return_value=conn)
-        pool.acquire.return_value.__aexit__ = AsyncMock()
-        
-        return pool
+        app.dependency_overrides[get_db] = get_mock_db
+        app.dependency_overrides[get_current_active_user] = lambda: _TEST_USER
+        app.dependency_overrides[get_document_processor] = lambda: mock_document_processor
+        app.dependency_overrides[get_vector_store] = lambda: mock_vector_store
     
     async def test_upload_document_success(self, client: AsyncClient, mock_pool, mock_document_processor):
         """Test successful document upload."""
         # Mock database responses
         mock_conn = mock_pool.acquire.return_value.__aenter__.return_value
-        mock_conn.fetchone.return_value = {
-            "id": uuid4(),
-            "name": "test.pdf",
-            "mime_type": "application/pdf",
-            "size": 1024,
-            "status": "processed",
-            "chunk_count": 5,
-            "created_at": datetime.utcnow(),
-            "processed_at": datetime.utcnow()
-        }
-        
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            with patch("backend.api.v1.documents.get_document_processor", 
-                      return_value=mock_document_processor):
-                
-                # Create test file
-                files = {"file": ("test.pdf", b"PDF content", "application/pdf")}
-                
-                response = await client.post("/api/v1/documents/upload", files=files)
+        mock_conn.fetchrow.return_value = _document_row(_UUIDS[1], "test.pdf")
+        
+        # Create test file
+        files = {"file": ("test.pdf", b"PDF content", "application/pdf")}
+        
+        response = await client.post("/api/v1/documents/upload", files=files)
         
         assert response.status_code == status.HTTP_200_OK
         data = response.json()
-        assert data["name"] == "test.pdf"
+        assert data["original_name"] == "test.pdf"
         assert data["status"] == "processed"
-        assert data["chunk_count"] == 5
+        mock_document_processor.process_document.assert_awaited_once()
+        # The processing result's status and S3 key are written back to the row
+        assert any(
+            call.args[1:3] == ("processed", _PROCESS_RESULT["s3_key"])
+            for call in mock_conn.execute.await_args_list
+        )
     
     async def test_upload_document_invalid_type(self, client: AsyncClient):
         """Test upload with invalid file type."""
@@ -90,13 +193,13 @@ class TestDocumentAPI:
         response = await client.post("/api/v1/documents/upload", files=files)
         
         assert response.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
-        assert "Unsupported file type" in response.json()["detail"]
+        assert "File type not supported" in response.json()["detail"]
     
-    async def test_upload_document_too_large(self, client: AsyncClient):
+    async def test_upload_document_too_large(self, client: AsyncClient, monkeypatch):
         """Test upload with file too large."""
-        # Create large content (over 10MB)
-        large_content = b"x" * (11 * 1024 * 1024)
-        files = {"file": ("large.pdf", large_content, "application/pdf")}
+        # Shrink the limit so the size check needs only a small payload
+        monkeypatch.setattr(settings, "max_file_size", 1024)
+        files = {"file": ("large.pdf", b"x" * 1025, "application/pdf")}
         
         response = await client.post("/api/v1/documents/upload", files=files)
         
@@ -108,37 +211,18 @@ class TestDocumentAPI:
         # Mock database response
         mock_conn = mock_pool.acquire.return_value.__aenter__.return_value
         mock_conn.fetch.return_value = [
-            {
-                "id": uuid4(),
-                "name": "doc1.pdf",
-                "mime_type": "application/pdf",
-                "size": 1024,
-                "status": "processed",
-                "chunk_count": 5,
-                "created_at": datetime.utcnow(),
-                "processed_at": datetime.utcnow()
-            },
-            {
-                "id": uuid4(),
-                "name": "doc2.txt",
-                "mime_type": "text/plain",
-                "size": 512,
-                "status": "processed",
-                "chunk_count": 2,
-                "created_at": datetime.utcnow(),
-                "processed_at": datetime.utcnow()
-            }
+            _document_row(_UUIDS[2], "doc1.pdf"),
+            _document_row(_UUIDS[3], "doc2.txt", content_type="text/plain", file_size=512)
         ]
         mock_conn.fetchval.return_value = 2  # Total count
         
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            response = await client.get("/api/v1/documents?skip=0&limit=10")
+        response = await client.get("/api/v1/documents/?skip=0&limit=10")
         
         assert response.status_code == status.HTTP_200_OK
         data = response.json()
         assert len(data["documents"]) == 2
         assert data["total"] == 2
-        assert data["documents"][0]["name"] == "doc1.pdf"
+        assert data["documents"][0]["original_name"] == "doc1.pdf"
     
     async def test_list_documents_with_filter(self, client: AsyncClient, mock_pool):
         """Test listing documents with status filter."""
@@ -146,102 +230,72 @@ class TestDocumentAPI:
         mock_conn.fetch.return_value = []
         mock_conn.fetchval.return_value = 0
         
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            response = await client.get("/api/v1/documents?status=processing")
+        response = await client.get("/api/v1/documents/?status=processing")
         
         assert response.status_code == status.HTTP_200_OK
         
         # Verify filter was applied in query
         call_args = mock_conn.fetch.call_args[0][0]
-        assert "WHERE status = $3" in call_args
+        assert "AND status = $2" in call_args
     
     async def test_get_document(self, client: AsyncClient, mock_pool):
         """Test getting single document."""
-        doc_id = uuid4()
+        doc_id = _UUIDS[4]
+        doc_id_str = str(doc_id)
         mock_conn = mock_pool.acquire.return_value.__aenter__.return_value
-        mock_conn.fetchone.return_value = {
-            "id": doc_id,
-            "name": "test.pdf",
-            "mime_type": "application/pdf",
-            "size": 1024,
-            "status": "processed",
-            "chunk_count": 5,
-            "created_at": datetime.utcnow(),
-            "processed_at": datetime.utcnow()
-        }
-        
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            response = await client.get(f"/api/v1/documents/{doc_id}")
+        mock_conn.fetchrow.return_value = _document_row(doc_id, "test.pdf")
+        
+        response = await client.get(f"/api/v1/documents/{doc_id_str}")
         
         assert response.status_code == status.HTTP_200_OK
         data = response.json()
-        assert data["id"] == str(doc_id)
-        assert data["name"] == "test.pdf"
+        assert data["id"] == doc_id_str
+        assert data["original_name"] == "test.pdf"
     
     async def test_get_document_not_found(self, client: AsyncClient, mock_pool):
         """Test getting non-existent document."""
-        doc_id = uuid4()
+        path = f"/api/v1/documents/{_UUIDS[5]}"
         mock_conn = mock_pool.acquire.return_value.__aenter__.return_value
-        mock_conn.fetchone.return_value = None
+        mock_conn.fetchrow.return_value = None
         
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            response = await client.get(f"/api/v1/documents/{doc_id}")
+        response = await client.get(path)
         
         assert response.status_code == status.HTTP_404_NOT_FOUND
         assert "Document not found" in response.json()["detail"]
     
-    async def test_delete_document(self, client: AsyncClient, mock_pool):
+    async def test_delete_document(self, client: AsyncClient, mock_pool, mock_document_processor,
+                                   mock_vector_store):
         """Test deleting document."""
-        doc_id = uuid4()
+        doc_id = _UUIDS[6]
+        path = f"/api/v1/documents/{doc_id}"
         mock_conn = mock_pool.acquire.return_value.__aenter__.return_value
-        mock_conn.fetchone.return_value = {
-            "id": doc_id,
-            "s3_key": "documents/123/test.pdf",
-            "original_s3_key": "originals/123/test.pdf"
-        }
-        
-        mock_s3 = Mock()
-        mock_s3.delete_object = AsyncMock()
+        mock_conn.fetchrow.return_value = _Record(id=doc_id, s3_key="documents/123/test.pdf")
         
-        mock_vector_store = Mock()
-        mock_vector_store.delete_document_vectors = AsyncMock(return_value=5)
-        
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            with patch("backend.api.v1.documents.get_s3_client", return_value=mock_s3):
-                with patch("backend.api.v1.documents.get_vector_store", 
-                          return_value=mock_vector_store):
-                    response = await client.delete(f"/api/v1/documents/{doc_id}")
+        response = await client.delete(path)
         
         assert response.status_code == status.HTTP_200_OK
         assert "deleted successfully" in response.json()["message"]
         
-        # Verify S3 deletions
-        assert mock_s3.delete_object.call_count == 2
+        # Verify S3 deletion of the stored (redacted) copy
+        mock_document_processor.delete_from_s3.assert_awaited_once_with("documents/123/test.pdf")
         
         # Verify vector deletion
         mock_vector_store.delete_document_vectors.assert_called_once_with(doc_id)
     
-    async def test_download_document(self, client: AsyncClient, mock_pool):
+    async def test_download_document(self, client: AsyncClient, mock_pool, mock_document_processor):
         """Test downloading document."""
-        doc_id = uuid4()
+        path = f"/api/v1/documents/{_UUIDS[7]}/download"
         mock_conn = mock_pool.acquire.return_value.__aenter__.return_value
-        mock_conn.fetchone.return_value = {
-            "id": doc_id,
-            "name": "test.pdf",
-            "mime_type": "application/pdf",
-            "s3_key": "documents/123/test.pdf"
-        }
-        
-        mock_s3 = Mock()
-        mock_s3.get_object = AsyncMock(
-            return_value={
-                "Body": AsyncMock(read=AsyncMock(return_value=b"PDF content"))
-            }
+        mock_conn.fetchrow.return_value = _Record(
+            original_name="test.pdf",
+            s3_key="documents/123/test.pdf",
+            content_type="application/pdf"
         )
         
-        with patch("backend.api.v1.documents.get_db_pool", return_value=mock_pool):
-            with patch("backend.api.v1.documents.get_s3_client", return_value=mock_s3):
-                response = await client.get(f"/api/v1/documents/{doc_id}/download")
+        # S3 access goes through the document processor
+        mock_document_processor.download_from_s3.return_value = b"PDF content"
+        
+        response = await client.get(path)
         
         assert response.status_code == status.HTTP_200_OK
         assert response.headers["content-type"] == "application/pdf"
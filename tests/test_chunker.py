@@ -0,0 +1,45 @@
+"""
+Tests for chunk boundary detection.
+"""
+
+from unittest.mock import patch
+
+import numpy as np
+
+from backend.services import _chunker
+from backend.services._chunker import SEPARATORS, find_chunk_spans
+
+
+def test_chunks_end_at_sentence_boundaries():
+    """Chunks break after the last separator that fits in the window."""
+    text = "First sentence. " * 100
+
+    spans = find_chunk_spans(text, chunk_size=100, overlap=20)
+
+    assert len(spans) > 1
+    assert spans[0][0] == 0
+    assert spans[-1][1] >= len(text)
+    for (prev_start, prev_end), (start, end) in zip(spans, spans[1:]):
+        assert text[prev_end - 2:prev_end] == ". "
+        assert prev_start < start < prev_end  # Should have overlap
+
+
+def test_chunks_without_separators_are_sliding_windows():
+    """Text without separators is split into fixed windows advancing by size - overlap."""
+    spans = find_chunk_spans("x" * 250, chunk_size=100, overlap=20)
+
+    assert spans == [(0, 100), (80, 180), (160, 260)]
+
+
+def test_chunking_large_text_is_linear():
+    """Chunking 1 MB of text scans for separators once, then does a bounded search per chunk."""
+    text = ("First sentence. Second one! Third? " * 30000)[:1_000_000]
+
+    # Count work instead of timing it, so the test doesn't depend on machine load
+    with patch.object(_chunker, "_separator_positions", wraps=_chunker._separator_positions) as scan:
+        with patch.object(_chunker.np, "searchsorted", wraps=np.searchsorted) as search:
+            spans = find_chunk_spans(text, chunk_size=1000, overlap=200)
+
+    assert spans[-1][1] >= len(text)
+    assert scan.call_count == 1
+    assert search.call_count <= len(spans) * len(SEPARATORS)
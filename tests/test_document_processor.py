@@ -7,12 +7,10 @@ from unittest.mock import Mock, AsyncMock, patch, MagicMock
 import tempfile
 import os
 from uuid import uuid4
-import numpy as np
 
 from backend.services.document_processor import DocumentProcessorService
 
 
-@pytest.mark.asyncio
 class TestDocumentProcessorService:
     """Test document processor service functionality."""
     
@@ -3,183 +3,163 @@ Tests for embeddings service.
 """
 
 import pytest
+import asyncio
 import numpy as np
 from unittest.mock import Mock, AsyncMock, patch
-import json
+import orjson
+from botocore.exceptions import ClientError
 
 from backend.services.embeddings import EmbeddingsService
 
 
-@pytest.mark.asyncio
+# Seeded generator for mock Bedrock embeddings
+_rng = np.random.default_rng(0)
+
+
+# Canned Titan embedding; orjson output is reused as the response body of every call
+_TITAN_EMBEDDING = _rng.random(1536, dtype=np.float32).tolist()
+
+
+def _titan_response(embedding=_TITAN_EMBEDDING) -> dict:
+    """Build an invoke_model response carrying `embedding`."""
+    body = orjson.dumps({"embedding": embedding, "inputTextTokenCount": 5})
+    return {"body": Mock(read=Mock(return_value=body))}
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "InvokeModel")
+
+
 class TestEmbeddingsService:
-    """Test embeddings service functionality."""
+    """Test embeddings service functionality against a stubbed Bedrock client."""
     
     @pytest.fixture
     def mock_bedrock_client(self):
-        """Create mock Bedrock client."""
+        """Stub Bedrock runtime client; invoke_model is called synchronously in the worker threads."""
         client = Mock()
-        
-        # Mock successful embedding response
-        async def mock_invoke_model(**kwargs):
-            body = json.loads(kwargs["body"])
-            input_text = body.get("inputText", "")
-            
-            # Return mock embedding
-            response_body = json.dumps({
-                "embedding": np.random.rand(1536).tolist(),
-                "inputTextTokenCount": len(input_text.split())
-            })
-            
-            return {
-                "body": Mock(read=Mock(return_value=response_body.encode()))
-            }
-        
-        client.invoke_model = AsyncMock(side_effect=mock_invoke_model)
+        client.invoke_model = Mock(side_effect=lambda **kwargs: _titan_response())
         return client
     
-    async def test_generate_embedding(self, mock_bedrock_client):
+    @pytest.fixture
+    def service(self, mock_bedrock_client):
+        """EmbeddingsService wired to the stub client instead of boto3."""
+        with patch("backend.services.embeddings.boto3.client", return_value=mock_bedrock_client):
+            service = EmbeddingsService()
+        assert not service.use_mock
+        yield service
+        service.close()
+    
+    async def test_generate_embedding(self, service, mock_bedrock_client):
         """Test generating single embedding."""
-        service = EmbeddingsService(mock_bedrock_client)
-        
         text = "This is a test document"
         embedding = await service.generate_embedding(text)
         
         assert isinstance(embedding, np.ndarray)
         assert embedding.shape == (1536,)
-        assert np.linalg.norm(embedding) == pytest.approx(1.0, rel=1e-5)  # Normalized
+        assert embedding @ embedding == pytest.approx(1.0, rel=2e-5)  # Normalized (squared norm)
         
         # Verify Bedrock was called
         mock_bedrock_client.invoke_model.assert_called_once()
+        assert mock_bedrock_client.invoke_model.call_args.kwargs["modelId"] == service.model_id
     
-    async def test_generate_embeddings_batch(self, mock_bedrock_client):
+    async def test_generate_embeddings_batch(self, service, mock_bedrock_client):
         """Test generating multiple embeddings."""
-        service = EmbeddingsService(mock_bedrock_client)
-        
         texts = ["First text", "Second text", "Third text"]
         embeddings = await service.generate_embeddings(texts)
         
-        assert len(embeddings) == 3
-        for embedding in embeddings:
-            assert isinstance(embedding, np.ndarray)
-            assert embedding.shape == (1536,)
-            assert np.linalg.norm(embedding) == pytest.approx(1.0, rel=1e-5)
+        assert embeddings.shape == (3, 1536)
+        assert embeddings.dtype == np.float32
+        np.testing.assert_allclose(np.einsum("ij,ij->i", embeddings, embeddings), 1.0, rtol=2e-5)
         
-        # Should be called once per text
+        # Titan embeds one text per call
         assert mock_bedrock_client.invoke_model.call_count == 3
     
-    async def test_generate_embeddings_large_batch(self, mock_bedrock_client):
-        """Test generating embeddings for large batch."""
-        service = EmbeddingsService(mock_bedrock_client)
-        
-        # Create batch larger than max batch size (25)
+    async def test_generate_embeddings_large_batch(self, service, mock_bedrock_client):
+        """Test generating embeddings for a batch larger than Titan's batch size."""
         texts = [f"Text {i}" for i in range(30)]
         embeddings = await service.generate_embeddings(texts)
         
-        assert len(embeddings) == 30
-        # Should process in batches
+        assert embeddings.shape == (30, 1536)
         assert mock_bedrock_client.invoke_model.call_count == 30
+        # Every text was sent exactly once
+        sent = [
+            orjson.loads(call.kwargs["body"])["inputText"]
+            for call in mock_bedrock_client.invoke_model.call_args_list
+        ]
+        assert sorted(sent) == sorted(texts)
     
-    async def test_generate_embeddings_empty_text(self, mock_bedrock_client):
-        """Test handling empty text."""
-        service = EmbeddingsService(mock_bedrock_client)
-        
-        with pytest.raises(ValueError, match="Text cannot be empty"):
-            await service.generate_embedding("")
+    async def test_generate_embeddings_empty_batch(self, service, mock_bedrock_client):
+        """Test that an empty batch returns an empty matrix without calling Bedrock."""
+        embeddings = await service.generate_embeddings([])
         
-        with pytest.raises(ValueError, match="No texts provided"):
-            await service.generate_embeddings([])
+        assert embeddings.shape == (0, 1536)
+        mock_bedrock_client.invoke_model.assert_not_called()
     
-    async def test_generate_embeddings_without_normalization(self, mock_bedrock_client):
+    async def test_generate_embeddings_without_normalization(self, service, mock_bedrock_client):
         """Test generating embeddings without normalization."""
-        # Mock to return non-normalized embedding
-        async def mock_invoke_model(**kwargs):
-            response_body = json.dumps({
-                "embedding": [2.0] * 1536,  # Non-normalized
-                "inputTextTokenCount": 5
-            })
-            return {
-                "body": Mock(read=Mock(return_value=response_body.encode()))
-            }
-        
-        mock_bedrock_client.invoke_model = AsyncMock(side_effect=mock_invoke_model)
-        service = EmbeddingsService(mock_bedrock_client)
+        mock_bedrock_client.invoke_model.side_effect = lambda **kwargs: _titan_response([2.0] * 1536)
         
         embedding = await service.generate_embedding("test", normalize=False)
         
         # Should not be normalized
-        assert np.linalg.norm(embedding) > 1.0
+        assert embedding @ embedding > 1.0
     
-    async def test_estimate_tokens(self):
+    async def test_estimate_tokens(self, service):
         """Test token estimation."""
-        service = EmbeddingsService(Mock())
-        
-        # Single text
-        tokens = service.estimate_tokens("This is a test sentence.")
-        assert tokens == 5  # Rough estimate
-        
-        # Multiple texts
-        tokens = service.estimate_tokens(["First sentence.", "Second sentence."])
-        assert tokens == 4  # 2 + 2
+        # Rough estimate: 4 characters per token
+        assert await service.estimate_tokens("This is a test sentence.") == 6
+        assert await service.estimate_tokens("") == 0
     
-    async def test_health_check_success(self, mock_bedrock_client):
+    async def test_health_check_success(self, service, mock_bedrock_client):
         """Test successful health check."""
-        service = EmbeddingsService(mock_bedrock_client)
-        
         health = await service.health_check()
         
         assert health["status"] == "healthy"
         assert health["model"] == "amazon.titan-embed-text-v1"
-        assert "test_embedding_dimensions" in health
-        assert health["test_embedding_dimensions"] == 1536
+        assert health["embedding_dimensions"] == 1536
+        assert health["using_mock"] is False
+        mock_bedrock_client.invoke_model.assert_called_once()
     
-    async def test_health_check_failure(self):
+    async def test_health_check_failure(self, service):
         """Test health check with failure."""
-        # Mock client that raises exception
-        mock_client = Mock()
-        mock_client.invoke_model = AsyncMock(side_effect=Exception("Connection error"))
-        
-        service = EmbeddingsService(mock_client)
-        health = await service.health_check()
+        with patch.object(service, "generate_embeddings", AsyncMock(side_effect=Exception("Connection error"))):
+            health = await service.health_check()
         
         assert health["status"] == "unhealthy"
-        assert "error" in health
         assert "Connection error" in health["error"]
+        assert health["test_successful"] is False
+    
+    async def test_bedrock_failure_falls_back_to_mock(self, service, mock_bedrock_client):
+        """Test that a non-retryable Bedrock error switches the service to mock embeddings."""
+        mock_bedrock_client.invoke_model.side_effect = _client_error("AccessDeniedException")
+        
+        embedding = await service.generate_embedding("test")
+        
+        assert embedding.shape == (1536,)
+        assert service.use_mock
+        mock_bedrock_client.invoke_model.assert_called_once()
     
-    async def test_retry_on_throttling(self):
+    async def test_retry_on_throttling(self, service, mock_bedrock_client):
         """Test retry logic on throttling errors."""
-        mock_client = Mock()
-        call_count = 0
-        
-        async def mock_invoke_with_throttle(**kwargs):
-            nonlocal call_count
-            call_count += 1
-            
-            if call_count < 3:
-                # Simulate throttling error
-                raise Exception("ThrottlingException")
-            
-            # Success on third attempt
-            response_body = json.dumps({
-                "embedding": np.random.rand(1536).tolist(),
-                "inputTextTokenCount": 5
-            })
-            return {
-                "body": Mock(read=Mock(return_value=response_body.encode()))
-            }
-        
-        mock_client.invoke_model = AsyncMock(side_effect=mock_invoke_with_throttle)
-        service = EmbeddingsService(mock_client)
+        mock_bedrock_client.invoke_model.side_effect = [
+            _client_error("ThrottlingException"),
+            _client_error("ThrottlingException"),
+            _titan_response(),
+        ]
+        
+        # Skip the backoff delays
+        with patch("backend.services.embeddings.asyncio.sleep", AsyncMock()) as sleep:
+            embedding = await service.generate_embedding("test")
         
         # Should succeed after retries
-        embedding = await service.generate_embedding("test")
         assert isinstance(embedding, np.ndarray)
-        assert call_count == 3
+        assert not service.use_mock
+        assert mock_bedrock_client.invoke_model.call_count == 3
+        assert sleep.await_count == 2
     
-    async def test_long_text_truncation(self, mock_bedrock_client):
+    async def test_long_text_truncation(self, service, mock_bedrock_client):
         """Test handling of long text."""
-        service = EmbeddingsService(mock_bedrock_client)
-        
-        # Create text longer than token limit
+        # Create text longer than Titan's input limit
         long_text = " ".join(["word"] * 10000)
         
         # Should truncate and still generate embedding
@@ -188,6 +168,63 @@ class TestEmbeddingsService:
         assert embedding.shape == (1536,)
         
         # Check that text was truncated in the call
-        call_args = mock_bedrock_client.invoke_model.call_args
-        body = json.loads(call_args[1]["body"])
-        assert len(body["inputText"]) < len(long_text)
\ No newline at end of file
+        body = orjson.loads(mock_bedrock_client.invoke_model.call_args.kwargs["body"])
+        assert len(body["inputText"]) == service.max_text_length
+
+
+async def test_embedding_cache_hit():
+    """Repeated queries are served from the query embedding cache."""
+    response_body = orjson.dumps({"embedding": [0.5] * 1536})
+    client = Mock()
+    client.invoke_model = Mock(
+        side_effect=lambda **kwargs: {"body": Mock(read=Mock(return_value=response_body))}
+    )
+    
+    service = EmbeddingsService()
+    service.client = client
+    service.use_mock = False
+    
+    first = await service.generate_embedding("q")
+    first[:] = 0  # callers must not be able to modify the cached vector
+    second = await service.generate_embedding("q")
+    
+    assert client.invoke_model.call_count == 1
+    assert second @ second == pytest.approx(1.0, rel=2e-5)
+
+
+async def test_health_check_bypasses_cache():
+    """The health check calls the model even when "test" is already cached."""
+    response_body = orjson.dumps({"embedding": [0.5] * 1536})
+    client = Mock()
+    client.invoke_model = Mock(
+        side_effect=lambda **kwargs: {"body": Mock(read=Mock(return_value=response_body))}
+    )
+    
+    service = EmbeddingsService()
+    service.client = client
+    service.use_mock = False
+    
+    await service.generate_embedding("test")
+    health = await service.health_check()
+    
+    assert health["status"] == "healthy"
+    assert client.invoke_model.call_count == 2
+
+
+async def test_concurrent_queries_coalesce():
+    """Concurrent requests for the same query share one Bedrock call."""
+    response_body = orjson.dumps({"embedding": [0.5] * 1536})
+    client = Mock()
+    client.invoke_model = Mock(
+        side_effect=lambda **kwargs: {"body": Mock(read=Mock(return_value=response_body))}
+    )
+    
+    service = EmbeddingsService()
+    service.client = client
+    service.use_mock = False
+    
+    results = await asyncio.gather(*(service.generate_embedding("q") for _ in range(25)))
+    
+    assert client.invoke_model.call_count == 1
+    assert len({id(result) for result in results}) == 25  # each caller gets its own copy
+    assert not service._inflight
@@ -3,31 +3,66 @@ Tests for vector store service.
 """
 
 import pytest
+import asyncio
+import time
+import asyncpg
 import numpy as np
-from uuid import uuid4
+from uuid import UUID, uuid4
 from typing import List, Tuple
 
-from backend.services.vector_store import VectorStoreService
+from backend.core.config import settings
+from backend.services.vector_store import VectorStore, _PARALLEL_COPY_THRESHOLD
+from tests.utils import create_test_document_rows, create_test_embeddings
+
+
+# Shares the test database with other modules (clean_db truncates it), so
+# under pytest-xdist every database module runs on the same worker
+pytestmark = pytest.mark.xdist_group("database")
+
+# Seeded so test setup is deterministic; each test draws its vectors as one matrix
+_rng = np.random.default_rng(0)
+
+
+def _random_vectors(count: int) -> np.ndarray:
+    """Draw `count` random vectors as one (count, 1536) float32 matrix."""
+    return _rng.random((count, 1536), dtype=np.float32)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normalize each row of a vector matrix."""
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+async def _wait_for_write(store: VectorStore, generation: int) -> None:
+    """Wait until `store` has been notified of a chunk write made after `generation`."""
+    for _ in range(100):
+        if store._generation != generation:
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError("chunks_changed notification was not delivered")
+
+
+# Documents seeded once for the similarity search cases
+_DOC_ID = UUID(int=1)
+_OTHER_DOC_ID = UUID(int=2)
+_MISSING_DOC_ID = UUID(int=3)
 
 
-@pytest.mark.asyncio
 class TestVectorStoreService:
     """Test vector store service functionality."""
     
     async def test_upsert_vectors(self, db_pool, clean_db):
         """Test upserting vectors."""
-        service = VectorStoreService(db_pool)
+        service = VectorStore(db_pool)
         
         # Prepare test data
         doc_id = uuid4()
-        vectors = [
-            (uuid4(), np.random.rand(1536), {"content": "test1", "index": 0}),
-            (uuid4(), np.random.rand(1536), {"content": "test2", "index": 1}),
-        ]
+        await create_test_document_rows(db_pool, doc_id)
+        chunks = ["test1", "test2"]
         
-        # Upsert vectors
-        success = await service.upsert_vectors(doc_id, vectors)
-        assert success is True
+        # Upsert vectors; all rows go to the database in one COPY
+        chunk_ids = await service.upsert_vectors(doc_id, chunks, _random_vectors(2))
+        assert len(chunk_ids) == 2
         
         # Verify vectors were inserted
         async with db_pool.acquire() as conn:
@@ -37,125 +72,34 @@ class TestVectorStoreService:
             )
             assert count == 2
     
-    async def test_similarity_search(self, db_pool, clean_db):
-        """Test similarity search."""
-        service = VectorStoreService(db_pool)
-        
-        # Insert test vectors
-        doc_id = uuid4()
-        base_vector = np.random.rand(1536)
-        base_vector = base_vector / np.linalg.norm(base_vector)  # Normalize
-        
-        vectors = [
-            (uuid4(), base_vector, {"content": "exact match", "index": 0}),
-            (uuid4(), base_vector + np.random.rand(1536) * 0.1, {"content": "similar", "index": 1}),
-            (uuid4(), np.random.rand(1536), {"content": "different", "index": 2}),
-        ]
-        
-        await service.upsert_vectors(doc_id, vectors)
-        
-        # Search for similar vectors
-        results = await service.similarity_search(base_vector, k=2)
-        
-        assert len(results) == 2
-        assert results[0][1] == "exact match"  # Content
-        assert results[0][2] > 0.9  # High similarity score
-    
-    async def test_similarity_search_with_filter(self, db_pool, clean_db):
-        """Test similarity search with document filter."""
-        service = VectorStoreService(db_pool)
-        
-        # Insert vectors for multiple documents
-        doc1_id = uuid4()
-        doc2_id = uuid4()
-        query_vector = np.random.rand(1536)
-        
-        await service.upsert_vectors(doc1_id, [
-            (uuid4(), query_vector, {"content": "doc1 content", "index": 0}),
-        ])
-        
-        await service.upsert_vectors(doc2_id, [
-            (uuid4(), query_vector, {"content": "doc2 content", "index": 0}),
-        ])
-        
-        # Search with filter
-        results = await service.similarity_search(
-            query_vector,
-            k=5,
-            filter_document_ids=[doc1_id]
-        )
-        
-        assert len(results) == 1
-        assert results[0][1] == "doc1 content"
-    
-    async def test_similarity_search_with_threshold(self, db_pool, clean_db):
-        """Test similarity search with threshold."""
-        service = VectorStoreService(db_pool)
-        
-        # Insert vectors with varying similarity
-        doc_id = uuid4()
-        base_vector = np.random.rand(1536)
-        base_vector = base_vector / np.linalg.norm(base_vector)
-        
-        # Create vectors with different similarities
-        similar_vector = base_vector + np.random.rand(1536) * 0.05
-        similar_vector = similar_vector / np.linalg.norm(similar_vector)
-        
-        different_vector = np.random.rand(1536)
-        different_vector = different_vector / np.linalg.norm(different_vector)
-        
-        vectors = [
-            (uuid4(), base_vector, {"content": "exact", "index": 0}),
-            (uuid4(), similar_vector, {"content": "similar", "index": 1}),
-            (uuid4(), different_vector, {"content": "different", "index": 2}),
-        ]
-        
-        await service.upsert_vectors(doc_id, vectors)
-        
-        # Search with high threshold
-        results = await service.similarity_search(
-            base_vector,
-            k=10,
-            threshold=0.8
-        )
-        
-        # Should only return highly similar vectors
-        assert len(results) <= 2
-        for result in results:
-            assert result[2] >= 0.8  # Similarity score
-    
     async def test_get_document_chunks(self, db_pool, clean_db):
         """Test retrieving document chunks."""
-        service = VectorStoreService(db_pool)
+        service = VectorStore(db_pool)
         
         # Insert chunks
         doc_id = uuid4()
-        vectors = [
-            (uuid4(), np.random.rand(1536), {"content": f"chunk {i}", "index": i})
-            for i in range(5)
-        ]
+        await create_test_document_rows(db_pool, doc_id)
+        chunks = [f"chunk {i}" for i in range(5)]
         
-        await service.upsert_vectors(doc_id, vectors)
+        await service.upsert_vectors(doc_id, chunks, _random_vectors(5))
         
         # Get chunks
-        chunks = await service.get_document_chunks(doc_id)
+        stored = await service.get_document_chunks(doc_id)
         
-        assert len(chunks) == 5
+        assert len(stored) == 5
         # Verify chunks are ordered by index
-        for i, chunk in enumerate(chunks):
-            assert chunk["metadata"]["index"] == i
+        for i, chunk in enumerate(stored):
+            assert chunk["chunk_index"] == i
     
     async def test_delete_document_vectors(self, db_pool, clean_db):
         """Test deleting document vectors."""
-        service = VectorStoreService(db_pool)
+        service = VectorStore(db_pool)
         
         # Insert vectors
         doc_id = uuid4()
-        vectors = [
-            (uuid4(), np.random.rand(1536), {"content": "test", "index": 0}),
-        ]
+        await create_test_document_rows(db_pool, doc_id)
         
-        await service.upsert_vectors(doc_id, vectors)
+        await service.upsert_vectors(doc_id, ["test"], _random_vectors(1))
         
         # Delete vectors
         deleted = await service.delete_document_vectors(doc_id)
@@ -165,56 +109,212 @@ class TestVectorStoreService:
         chunks = await service.get_document_chunks(doc_id)
         assert len(chunks) == 0
     
-    async def test_get_index_stats(self, db_pool, clean_db):
-        """Test getting index statistics."""
-        service = VectorStoreService(db_pool)
-        
-        # Insert vectors for multiple documents
-        for i in range(3):
-            doc_id = uuid4()
-            vectors = [
-                (uuid4(), np.random.rand(1536), {"content": f"doc{i}", "index": 0}),
-            ]
-            await service.upsert_vectors(doc_id, vectors)
+    async def test_get_stats(self, db_pool, clean_db):
+        """Test getting vector store statistics."""
+        service = VectorStore(db_pool)
+        
+        # Insert vectors for multiple documents in one batch
+        doc_ids = [uuid4() for _ in range(3)]
+        await create_test_document_rows(db_pool, *doc_ids)
+        embeddings = _random_vectors(3)
+        await service.upsert_documents([
+            (doc_id, [f"doc{i}"], embeddings[i:i + 1], None)
+            for i, doc_id in enumerate(doc_ids)
+        ])
         
         # Get stats
-        stats = await service.get_index_stats()
+        stats = await service.get_stats()
         
-        assert stats["total_vectors"] == 3
-        assert stats["total_documents"] == 3
-        assert stats["index_size"] > 0
-        assert "vector_dimensions" in stats
+        assert stats["document_count"] == 3
+        assert stats["chunk_count"] == 3
+        assert stats["avg_chunk_length"] == 4.0
+        assert stats["last_indexed"] is not None
+        assert stats["indexes"]  # the HNSW embedding index
     
-    async def test_empty_search(self, db_pool, clean_db):
-        """Test search with no results."""
-        service = VectorStoreService(db_pool)
-        
-        query_vector = np.random.rand(1536)
-        results = await service.similarity_search(query_vector, k=5)
-        
-        assert len(results) == 0
-    
-    async def test_vector_normalization(self, db_pool, clean_db):
-        """Test that vectors are properly normalized."""
-        service = VectorStoreService(db_pool)
+    async def test_vector_stored_unchanged(self, db_pool, clean_db):
+        """Test that embeddings are stored exactly as given; normalizing is the embeddings service's job."""
+        service = VectorStore(db_pool)
         
         # Insert unnormalized vector
         doc_id = uuid4()
-        vector = np.array([3.0, 4.0] + [0.0] * 1534)  # Simple 3-4-5 triangle
-        vectors = [(uuid4(), vector, {"content": "test", "index": 0})]
+        await create_test_document_rows(db_pool, doc_id)
+        vector = np.zeros((1, 1536), dtype=np.float32)
+        vector[0, :2] = (3.0, 4.0)  # Simple 3-4-5 triangle
         
-        await service.upsert_vectors(doc_id, vectors)
+        await service.upsert_vectors(doc_id, ["test"], vector)
         
-        # Retrieve and check normalization
         async with db_pool.acquire() as conn:
             stored_vector = await conn.fetchval(
                 "SELECT embedding FROM chunks WHERE document_id = $1",
                 doc_id
             )
+        
+        # The binary pgvector codec already decodes to a float32 array
+        assert stored_vector.dtype == np.float32
+        np.testing.assert_array_equal(stored_vector, vector[0])
+    
+    async def test_upsert_large_document(self, db_pool, clean_db):
+        """Test that a document over the parallel COPY threshold replaces its old chunks."""
+        service = VectorStore(db_pool)
+        doc_id = uuid4()
+        await create_test_document_rows(db_pool, doc_id)
+        await service.upsert_vectors(doc_id, ["old"], _random_vectors(1))
+        
+        count = _PARALLEL_COPY_THRESHOLD + 1
+        chunk_ids = await service.upsert_vectors(
+            doc_id, [f"chunk {i}" for i in range(count)], _random_vectors(count)
+        )
+        assert len(chunk_ids) == count
+        
+        async with db_pool.acquire() as conn:
+            contents = await conn.fetch("SELECT content FROM chunks WHERE document_id = $1", doc_id)
+        assert len(contents) == count
+        assert "old" not in {row["content"] for row in contents}
+    
+    async def test_failed_large_upsert_keeps_old_chunks(self, db_pool, clean_db):
+        """Test that a failed parallel COPY leaves the document's previous chunks in place."""
+        service = VectorStore(db_pool)
+        doc_id = uuid4()
+        await create_test_document_rows(db_pool, doc_id)
+        await service.upsert_vectors(doc_id, ["old"], _random_vectors(1))
+        
+        # content is NOT NULL, so the last shard's COPY fails
+        count = _PARALLEL_COPY_THRESHOLD + 1
+        chunks = [f"chunk {i}" for i in range(count - 1)] + [None]
+        with pytest.raises(asyncpg.NotNullViolationError):
+            await service.upsert_vectors(doc_id, chunks, _random_vectors(count))
+        
+        async with db_pool.acquire() as conn:
+            contents = await conn.fetch("SELECT content FROM chunks WHERE document_id = $1", doc_id)
+            staging_tables = await conn.fetchval(
+                "SELECT COUNT(*) FROM pg_tables WHERE tablename LIKE 'chunks_load_%'"
+            )
+        assert [row["content"] for row in contents] == ["old"]
+        assert staging_tables == 0
+    
+    async def test_initialize_finds_halfvec_index(self, db_pool, monkeypatch):
+        """Test that searches order by the half-precision index once initialize() has found it."""
+        monkeypatch.setattr(settings, "vector_halfvec_index", True)
+        monkeypatch.setattr(settings, "vector_cache_size", 0)  # no listener connection needed
+        service = VectorStore(db_pool)
+        assert "halfvec" not in service._sql_variants[(False, False)]
+        
+        await service.initialize()
+        
+        assert "halfvec" in service._sql_variants[(False, False)]
+    
+    async def test_search_cache_sees_other_workers_writes(self, db_pool, clean_db):
+        """Test that a write through one store invalidates another store's cached results."""
+        reader = VectorStore(db_pool)
+        writer = VectorStore(db_pool)  # Stands in for another worker process
+        query = create_test_embeddings(1)[0]
+        first_id, second_id = uuid4(), uuid4()
+        await create_test_document_rows(db_pool, first_id, second_id)
+        
+        await reader.initialize()
+        try:
+            await writer.upsert_vectors(first_id, ["first"], query[np.newaxis])
+            await _wait_for_write(reader, 0)
+            results = await reader.similarity_search(query, k=5)
+            assert [result[1] for result in results] == ["first"]
             
-            # Convert back to numpy array
-            stored_array = np.array(stored_vector)
+            # The reader's cache holds the first result until the write is announced
+            generation = reader._generation
+            await writer.upsert_vectors(second_id, ["second"], query[np.newaxis])
+            await _wait_for_write(reader, generation)
+            results = await reader.similarity_search(query, k=5)
+            assert sorted(result[1] for result in results) == ["first", "second"]
+        finally:
+            await reader.close()
+    
+    async def test_memory_index_sees_other_workers_writes(self, db_pool, clean_db, monkeypatch):
+        """Test that a write through one store keeps another store from serving its stale in-memory index."""
+        monkeypatch.setattr(settings, "vector_in_memory_index", True)
+        monkeypatch.setattr(settings, "vector_in_memory_reload_delay", 0.05)
+        writer = VectorStore(db_pool)  # Stands in for another worker process
+        query = create_test_embeddings(1)[0]
+        first_id, second_id = uuid4(), uuid4()
+        await create_test_document_rows(db_pool, first_id, second_id)
+        await writer.upsert_vectors(first_id, ["first"], query[np.newaxis])
+        
+        reader = VectorStore(db_pool)
+        await reader.initialize()
+        try:
+            assert reader._memory_index is not None
+            results = await reader.similarity_search(query, k=5)
+            assert [result[1] for result in results] == ["first"]
             
-            # Check if normalized (magnitude should be 1)
-            magnitude = np.linalg.norm(stored_array)
-            assert abs(magnitude - 1.0) < 0.001
\ No newline at end of file
+            # The notification drops the stale index; searches use the database until it reloads
+            generation = reader._generation
+            await writer.upsert_vectors(second_id, ["second"], query[np.newaxis])
+            await _wait_for_write(reader, generation)
+            results = await reader.similarity_search(query, k=5)
+            assert sorted(result[1] for result in results) == ["first", "second"]
+            
+            if reader._memory_index_task is not None:
+                await asyncio.wait_for(reader._memory_index_task, timeout=5)
+            assert len(reader._memory_index.ids) == 2
+        finally:
+            await reader.close()
+
+
+class TestSimilaritySearch:
+    """Similarity search cases, all run against one seeded set of vectors."""
+    
+    @pytest.fixture(scope="class")
+    async def seeded_store(self, db_pool):
+        """Clean the database and insert the search vectors once for the whole class."""
+        async with db_pool.acquire() as conn:
+            await conn.execute("TRUNCATE TABLE documents, chunks, audit_log CASCADE")
+        await create_test_document_rows(db_pool, _DOC_ID, _OTHER_DOC_ID)
+        
+        service = VectorStore(db_pool)
+        base_vector, different_vector, other_vector = create_test_embeddings(3)
+        # Only the perturbed vector needs normalizing; the others come from the pool
+        similar_vector = _normalize(base_vector + _random_vectors(1)[0] * 0.05)
+        
+        await service.upsert_documents([
+            (
+                _DOC_ID,
+                ["exact match", "similar", "different"],
+                np.stack([base_vector, similar_vector, different_vector]),
+                None
+            ),
+            (_OTHER_DOC_ID, ["other document"], other_vector[np.newaxis], None),
+        ])
+        return service, base_vector
+    
+    @pytest.mark.parametrize("search_kwargs, expected_contents", [
+        pytest.param({"k": 2}, ["exact match", "similar"], id="nearest"),
+        pytest.param(
+            {"k": 5, "filter_document_ids": [_OTHER_DOC_ID]}, ["other document"], id="filter"
+        ),
+        pytest.param({"k": 10, "threshold": 0.95}, ["exact match", "similar"], id="threshold"),
+        pytest.param({"k": 5, "filter_document_ids": [_MISSING_DOC_ID]}, [], id="empty"),
+    ])
+    async def test_similarity_search(self, seeded_store, search_kwargs, expected_contents):
+        """Test similarity search with each combination of k, filter and threshold."""
+        service, base_vector = seeded_store
+        
+        results = await service.similarity_search(base_vector, **search_kwargs)
+        
+        assert [result[1] for result in results] == expected_contents
+        threshold = search_kwargs.get("threshold")
+        if threshold is not None:
+            assert all(result[2] >= threshold for result in results)
+        if expected_contents[:1] == ["exact match"]:
+            assert results[0][2] > 0.9  # High similarity score
+    
+    @pytest.mark.benchmark
+    async def test_similarity_search_latency(self, seeded_store):
+        """Repeated searches against the seeded store stay well under the latency budget."""
+        service, _ = seeded_store
+        # Distinct queries, so the result cache doesn't answer them
+        queries = create_test_embeddings(20)
+        
+        start = time.perf_counter()
+        for query in queries:
+            await service.similarity_search(query, k=5)
+        mean = (time.perf_counter() - start) / len(queries)
+        
+        assert mean < 0.05  # 50ms per search, including the database round-trip
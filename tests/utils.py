@@ -3,11 +3,40 @@ Test utilities and helpers.
 """
 
 import asyncio
+import itertools
+import re
 from typing import Dict, Any, List
-from uuid import uuid4
+from unittest.mock import AsyncMock, Mock
+from uuid import UUID
+import asyncpg
 import numpy as np
 from datetime import datetime
 
+# Test embeddings are drawn from a fixed pool built once at import, so helpers
+# don't pay for an RNG call and a norm per embedding. Embeddings repeat after
+# 256 draws.
+_EMBEDDING_POOL_SIZE = 256
+_EMBEDDING_POOL = np.random.default_rng(0).random((_EMBEDDING_POOL_SIZE, 1536), dtype=np.float32)
+_NORMALIZED_EMBEDDING_POOL = _EMBEDDING_POOL / np.linalg.norm(_EMBEDDING_POOL, axis=1, keepdims=True)
+_embedding_pool_rows = itertools.cycle(range(_EMBEDDING_POOL_SIZE))
+
+# Fixed timestamp for test documents: deterministic, and no clock read per call
+_TEST_NOW = datetime(2024, 1, 1)
+
+# Canonical hyphenated UUID text
+_UUID_PATTERN = re.compile(
+    r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$",
+    re.IGNORECASE
+)
+
+# Test ids only need to be unique within the run, not random
+_test_ids = itertools.count(1)
+
+
+def _next_test_id() -> UUID:
+    """Return the next sequential test UUID."""
+    return UUID(int=next(_test_ids))
+
 
 def create_test_document(
     name: str = "test.pdf",
@@ -16,33 +45,32 @@ def create_test_document(
 ) -> Dict[str, Any]:
     """Create a test document dictionary."""
     return {
-        "id": uuid4(),
+        "id": _next_test_id(),
         "name": name,
         "mime_type": "application/pdf" if name.endswith(".pdf") else "text/plain",
         "size": 1024,
         "status": status,
-        "s3_key": f"documents/{uuid4()}/{name}",
-        "original_s3_key": f"originals/{uuid4()}/{name}",
+        "s3_key": f"documents/{_next_test_id()}/{name}",
+        "original_s3_key": f"originals/{_next_test_id()}/{name}",
         "chunk_count": chunk_count,
-        "created_at": datetime.utcnow(),
-        "processed_at": datetime.utcnow() if status == "processed" else None,
+        "created_at": _TEST_NOW,
+        "processed_at": _TEST_NOW if status == "processed" else None,
         "error": None
     }
 
 
 def create_test_chunk(
-    document_id: uuid4,
+    document_id: UUID,
     content: str,
     index: int = 0,
     embedding: np.ndarray = None
 ) -> Dict[str, Any]:
     """Create a test chunk dictionary."""
     if embedding is None:
-        embedding = np.random.rand(1536)
-        embedding = embedding / np.linalg.norm(embedding)
+        embedding = _NORMALIZED_EMBEDDING_POOL[next(_embedding_pool_rows)]
     
     return {
-        "id": uuid4(),
+        "id": _next_test_id(),
         "document_id": document_id,
         "content": content,
         "chunk_index": index,
@@ -58,13 +86,19 @@ def create_test_chunk(
 
 def create_test_embeddings(count: int, normalize: bool = True) -> List[np.ndarray]:
     """Create test embeddings."""
-    embeddings = []
-    for _ in range(count):
-        embedding = np.random.rand(1536)
-        if normalize:
-            embedding = embedding / np.linalg.norm(embedding)
-        embeddings.append(embedding)
-    return embeddings
+    pool = _NORMALIZED_EMBEDDING_POOL if normalize else _EMBEDDING_POOL
+    rows = [next(_embedding_pool_rows) for _ in range(count)]
+    # Fancy indexing copies, so callers can modify their embeddings freely
+    return list(pool[rows])
+
+
+async def create_test_document_rows(pool: asyncpg.Pool, *document_ids: UUID) -> None:
+    """Insert the documents rows that the chunks' foreign key points at."""
+    async with pool.acquire() as conn:
+        await conn.executemany(
+            "INSERT INTO documents (id, filename, original_name) VALUES ($1, $2, $2)",
+            [(document_id, f"{document_id}.txt") for document_id in document_ids]
+        )
 
 
 async def async_test_timeout(coro, timeout: float = 5.0):
@@ -79,16 +113,13 @@ def assert_valid_embedding(embedding: np.ndarray):
     """Assert that an embedding is valid."""
     assert isinstance(embedding, np.ndarray), "Embedding must be numpy array"
     assert embedding.shape == (1536,), f"Embedding must be 1536-dimensional, got {embedding.shape}"
-    assert not np.isnan(embedding).any(), "Embedding contains NaN values"
-    assert not np.isinf(embedding).any(), "Embedding contains infinite values"
+    # One pass over the array catches both NaN and infinite values
+    assert np.isfinite(embedding).all(), "Embedding contains NaN or infinite values"
 
 
 def assert_valid_uuid(value: str):
     """Assert that a string is a valid UUID."""
-    try:
-        uuid4(value)
-    except ValueError:
-        raise AssertionError(f"'{value}' is not a valid UUID")
+    assert _UUID_PATTERN.match(value), f"'{value}' is not a valid UUID"
 
 
 def create_mock_s3_response(content: bytes = b"test content") -> Dict[str, Any]:
@@ -128,4 +159,13 @@ class AsyncContextManagerMock:
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         self.exit_called = True
-        return False
\ No newline at end of file
+        return False
+
+
+def create_mock_pool(conn: Any) -> Mock:
+    """Create a mock asyncpg pool whose acquire() context yields `conn`."""
+    pool = Mock()
+    acquire_context = AsyncMock()
+    acquire_context.__aenter__.return_value = conn
+    pool.acquire.return_value = acquire_context
+    return pool